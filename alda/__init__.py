@@ -19,4 +19,13 @@
 
 __version__ = '0.1'
 
-from alda import ALDA, Package
+from alda import ALDA, ARCHES, Package, is_glob
+from cache import MetadataCache
+from checkpoint import Checkpoint
+from diff import Diff
+from fetch import FetchItem, fetch
+from manifest import Manifest
+from packagelist import parse_packages, read_packages
+from provenance import Provenance
+from server import Resolver, Server, request
+from stats import Stats
@@ -17,15 +17,43 @@
 # Author(s):    Martin Gracik <mgracik@redhat.com>
 #
 
-from collections import namedtuple
+import binascii
+import bisect
+from collections import deque, namedtuple
+import fnmatch
+import hashlib
 import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
+import re
 import shutil
 import tempfile
+import threading
+import time
 
 import hawkey
 import librepo
 
+from cache import ClosureCache, SharedClosures, checksum, du, flock
+from checkpoint import Checkpoint, get_run_key
+import fetch
+from manifest import Changes, Manifest, reldep_name
+from provenance import Provenance
+from stats import Stats
+
+
+# The ALDA resolving shards in parallel, inherited by the forked workers together with its sack.
+_sharding = None
+_sharding_lock = threading.Lock()
+
+# Arches resolved for --arch all, the same targets tools/build_repo.sh builds for.
+ARCHES = ('i686', 'x86_64', 'ppc', 'ppc64', 's390', 's390x')
+
+
+def is_glob(pattern):
+    return pattern is not None and any(c in pattern for c in '*?[')
+
 
 class Package(namedtuple('Package', 'name, arch')):
 
@@ -34,25 +62,23 @@ class Package(namedtuple('Package', 'name, arch')):
     def __str__(self):
         return '.'.join(self) if self.arch else self.name
 
+    @property
+    def is_glob(self):
+        return is_glob(self.name) or is_glob(self.arch)
+
+    def match(self, hpo):
+        if self.arch is not None and not fnmatch.fnmatchcase(hpo.arch, self.arch):
+            return False
+        return fnmatch.fnmatchcase(hpo.name, self.name)
+
 
 class PackageSelector(object):
 
     def __init__(self, package, sack):
         self.package = package
         self.sack = sack
-        self._query = None
         self._selector = None
 
-    @property
-    def query(self):
-        if not self._query:
-            query = hawkey.Query(self.sack)
-            if self.package.arch:
-                self._query = query.filter(name=self.package.name, arch=self.package.arch)
-            else:
-                self._query = query.filter(name=self.package.name)
-        return self._query
-
     @property
     def selector(self):
         if not self._selector:
@@ -96,83 +122,543 @@ class Goal(hawkey.Goal):
         return map(str, self.install_requests)
 
 
+class Solution(object):
+
+    '''A goal solution replayed from the builddeps closure cache.'''
+
+    def __init__(self, requests, installs):
+        self._install_requests = requests
+        self._installs = installs
+
+    def list_installs(self):
+        return list(self._installs)
+
+    @property
+    def install_requests(self):
+        return list(self._install_requests)
+
+    @property
+    def install_requests_as_strings(self):
+        return map(str, self.install_requests)
+
+
+class SackIndex(object):
+
+    def __init__(self, sack):
+        self.sack = sack
+        self.srpms = {}
+        self.binaries = {}
+        # Name -> arches of all packages, to look up requests without a query each.
+        self.names = {}
+        # Dense ids of the packages, for PackageSet.
+        self.packages = []
+        self.ids = {}
+        # Built on first use - the index can be shared by threads resolving against the same sack.
+        self._sorted_names = None
+        self._nevras = None
+        self._providers = None
+        self._file_providers = {}
+        self._newest = None
+        self._lock = threading.Lock()
+
+        query = hawkey.Query(self.sack)
+        query.run()
+        for hpo in query.result:
+            self.ids[hpo] = len(self.packages)
+            self.packages.append(hpo)
+            self.names.setdefault(hpo.name, set()).add(hpo.arch)
+            if hpo.arch == 'src':
+                # The sourcerpm tag of a binary package holds the file name of the source rpm.
+                self.srpms.setdefault(os.path.basename(hpo.location), hpo)
+            elif hpo.sourcerpm:
+                packages, debuginfo = self.binaries.setdefault(hpo.sourcerpm, ({}, {}))
+                group = debuginfo if '-debuginfo' in hpo.name else packages
+                group.setdefault(hpo.arch, []).append(hpo)
+
+    def has_package(self, name, arch=None):
+        # Without an arch, a name of source packages only - built into differently named
+        # binary packages - is not there to install.
+        arches = self.names.get(name)
+        if arches is None:
+            return False
+        return bool(arches - set(['src'])) if arch is None else arch in arches
+
+    def expand(self, package):
+        # Globs are matched only against the names sharing their literal prefix.
+        with self._lock:
+            if self._sorted_names is None:
+                self._sorted_names = sorted(self.names)
+        prefix = re.split(r'[*?\[]', package.name, 1)[0]
+        names = []
+        for name in self._sorted_names[bisect.bisect_left(self._sorted_names, prefix):]:
+            if not name.startswith(prefix):
+                break
+            names.append(name)
+
+        result = set()
+        for name in fnmatch.filter(names, package.name):
+            if package.arch is None:
+                if self.has_package(name):
+                    result.add(Package(name=name, arch=None))
+            else:
+                result.update(Package(name=name, arch=arch)
+                              for arch in fnmatch.filter(self.names[name], package.arch))
+        return result
+
+    def get_srpm(self, sourcerpm):
+        return self.srpms.get(sourcerpm)
+
+    def get_package(self, nevra, reponame):
+        with self._lock:
+            if self._nevras is None:
+                self._nevras = dict(((str(hpo), hpo.reponame), hpo) for hpo in self.packages)
+        return self._nevras.get((nevra, reponame))
+
+    def get_provider_names(self, name):
+        # Names of the packages providing a capability, files are looked up in the sack.
+        with self._lock:
+            if name.startswith('/'):
+                if name not in self._file_providers:
+                    query = hawkey.Query(self.sack).filter(file=name)
+                    self._file_providers[name] = set(hpo.name for hpo in query)
+                return self._file_providers[name]
+            if self._providers is None:
+                self._providers = {}
+                for hpo in self.packages:
+                    self._providers.setdefault(hpo.name, set()).add(hpo.name)
+                    for reldep in hpo.provides:
+                        self._providers.setdefault(reldep_name(reldep), set()).add(hpo.name)
+        return self._providers.get(name, set())
+
+    def is_newest(self, hpo):
+        with self._lock:
+            if self._newest is None:
+                self._newest = {}
+                for package in self.packages:
+                    key = (package.name, package.arch)
+                    if key not in self._newest or package.evr_cmp(self._newest[key]) > 0:
+                        self._newest[key] = package
+        return hpo.evr_cmp(self._newest[(hpo.name, hpo.arch)]) >= 0
+
+    def get_debuginfo(self, sourcerpm, arch):
+        _packages, debuginfo = self.binaries.get(sourcerpm, ({}, {}))
+        return debuginfo.get(arch, [])
+
+    def get_binaries(self, sourcerpm):
+        result = []
+        for group in self.binaries.get(sourcerpm, ()):
+            for packages in group.values():
+                result.extend(packages)
+        return result
+
+
+class _SolutionLimit(Exception):
+
+    '''Raised from the run_all callback to stop enumerating solutions.'''
+
+
+class PackageSet(object):
+
+    '''
+    A set of packages of one sack, kept as a flag per id of its SackIndex.
+
+    Membership and difference cost an id lookup per package instead of
+    building new sets of packages.
+
+    '''
+
+    def __init__(self, index=None):
+        self.index = index
+        self.flags = bytearray(len(index.packages) if index else 0)
+        self._len = 0
+
+    def __contains__(self, hpo):
+        i = self.index.ids.get(hpo) if self.index else None
+        return i is not None and self.flags[i] == 1
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        packages = self.index.packages if self.index else []
+        i = self.flags.find(b'\x01')
+        while i != -1:
+            yield packages[i]
+            i = self.flags.find(b'\x01', i + 1)
+
+    def add(self, hpo):
+        i = self.index.ids[hpo]
+        if not self.flags[i]:
+            self.flags[i] = 1
+            self._len += 1
+
+    def difference(self, packages):
+        # Packages missing from the index, e.g. of another sack, are not in the set either.
+        ids = self.index.ids if self.index else {}
+        flags = self.flags
+        result = []
+        for hpo in packages:
+            i = ids.get(hpo)
+            if i is None or not flags[i]:
+                result.append(hpo)
+        return result
+
+
 class Accumulator(object):
 
-    _active_requests = []
-    _max_requests = 0
-    _problems = None
-    _solved = None
+    REQUEST = 'request'
+    BUILDDEPS = 'builddeps'
+    SUBPACKAGE = 'subpackage'
 
-    @staticmethod
-    def update(accumulator, goal):
-        if accumulator.options.get('greedy'):
-            goal.run_all(accumulator.new_solution_cb)
-        elif goal.run():
-            accumulator.new_solution_cb(goal)
-        return accumulator
-
-    def __init__(self, options):
+    # Why a package was added - the kind of the goal that pulled it in, or its relation to a package.
+    REASONS = {REQUEST: 'dependency', BUILDDEPS: 'builddep', SUBPACKAGE: 'subpackage'}
+    SRPM = 'srpm'
+    DEBUGINFO = 'debuginfo'
+
+    def __init__(self, options, stats=None):
         self.log = logging.getLogger('alda.Accumulator')
         self.options = options
+        self.stats = stats if stats is not None else Stats()
         self.sack = None
-        self.query = None
+        self.index = None
         self.excludes = set()
-        self.data = set()
-        self._problems = set()
+        self._exclude_names = {}
+        self._exclude_globs = []
+        self._exclude_cache = {}
+        self.data = PackageSet()
+        self._problems = PackageSet()
         self._solved = set()
-
-    def set_sack(self, sack):
+        self._request = None
+        self._kind = self.REQUEST
+        self.added_cb = None
+        self.checkpoint_cb = None
+        # What every package was added for, and the package every queued goal was queued for.
+        self.provenance = Provenance()
+        self._causes = {}
+        self._cause = None
+        # SRPM -> builddeps solutions, shared between runs against the same repositories.
+        self.closures = None
+        # (kind, key) -> solutions and problems of every goal solved in this run, and the
+        # recorded ones of a previous run that are still valid.
+        self.solutions = {}
+        self.replay = {}
+        self.replayed = 0
+        # Builddeps and subpackages waiting to be solved, and everything ever queued.
+        self._queue = deque()
+        self._queued = set()
+        self.max_queue_depth = 0
+        self.processed = 0
+        self.process_time = 0.0
+        # Distinct greedy solutions processed in this run.
+        self.greedy_solutions = 0
+
+    def set_sack(self, sack, index=None):
         self.sack = sack
-        self.query = hawkey.Query(self.sack)
+        if index is None:
+            with self.stats.timer('index'):
+                index = SackIndex(self.sack)
+            self.stats.count('queries')
+        self.index = index
+        self.data = PackageSet(self.index)
+        self._problems = PackageSet(self.index)
 
     def set_excludes(self, excludes):
         self.excludes = excludes
+        # Literal names map to the excluded arches - None stands for all of them.
+        self._exclude_names = {}
+        self._exclude_globs = []
+        self._exclude_cache = {}
+        for expo in excludes:
+            if expo.is_glob:
+                self._exclude_globs.append(expo)
+            else:
+                self._exclude_names.setdefault(expo.name, set()).add(expo.arch)
+
+    def is_excluded(self, hpo):
+        arches = self._exclude_names.get(hpo.name)
+        if arches and (None in arches or hpo.arch in arches):
+            return True
+        if not self._exclude_globs:
+            return False
+
+        key = (hpo.name, hpo.arch)
+        if key not in self._exclude_cache:
+            self._exclude_cache[key] = any(expo.match(hpo) for expo in self._exclude_globs)
+        return self._exclude_cache[key]
+
+    def get_excluded(self, packages):
+        for hpo in packages:
+            if self.is_excluded(hpo):
+                return hpo
+        return None
 
     def _get_srpm(self, hpo):
         if not hpo.sourcerpm:
             return []
 
         assert hpo.sourcerpm.endswith('.src.rpm')
-        name, _version, _release = hpo.sourcerpm[:-8].rsplit('-', 2)
-        query = self.query.filter(name=name, arch='src')
-        query.run()
-        result = filter(lambda srpm: srpm.location.endswith(hpo.sourcerpm), query.result)
-        assert len(result) in (0, 1)
-        return result
+        self.stats.count('srpm_lookups')
+        srpm = self.index.get_srpm(hpo.sourcerpm)
+        return [srpm] if srpm else []
 
     def _get_debuginfo(self, hpo):
         if not hpo.sourcerpm:
             return []
 
-        query = self.query.filter(sourcerpm=hpo.sourcerpm, name__substr='-debuginfo', arch=hpo.arch)
-        query.run()
-        return query.result
+        self.stats.count('debuginfo_lookups')
+        return self.index.get_debuginfo(hpo.sourcerpm, hpo.arch)
 
     def _get_subpackages(self, hpo):
         if not hpo.sourcerpm:
             return []
 
-        query = self.query.filter(sourcerpm=hpo.sourcerpm)
-        query.run()
+        self.stats.count('subpackage_lookups')
+        return [po for po in self.data.difference(self.index.get_binaries(hpo.sourcerpm)) if not self.is_skipped(po)]
+
+    def set_closures(self, closures):
+        self.closures = closures
+
+    def set_replay(self, replay):
+        self.replay = replay
+
+    def set_added_cb(self, callback):
+        self.added_cb = callback
+
+    def set_checkpoint_cb(self, callback):
+        self.checkpoint_cb = callback
 
-        selectors = []
-        for po in (set(query.result) - self.data):
-            if po in self.skiplist:
+    def add(self, hpo, reason, cause):
+        self.data.add(hpo)
+        self.provenance.add(self.get_key(hpo), reason, cause)
+        self.log.debug('added %s %s', reason, hpo)
+        if self.added_cb:
+            self.added_cb(hpo, reason)
+
+    @staticmethod
+    def get_key(hpo):
+        return '%s/%s' % (hpo.reponame, hpo)
+
+    def solve(self, goal, callback=None):
+        callback = callback or self.new_solution_cb
+        self.stats.count('goals')
+        budget = self.options.get('max_greedy_solutions')
+        if self.options.get('greedy') and (budget is None or self.greedy_solutions < budget):
+            self.solve_all(goal, callback)
+            return goal.problems
+
+        with self.stats.timer('solve'):
+            solved = goal.run()
+        if solved:
+            with self.stats.timer('process'):
+                callback(goal)
+        return goal.problems
+
+    def solve_all(self, goal, callback):
+        max_solutions = self.options.get('max_solutions')
+        budget = self.options.get('max_greedy_solutions')
+        seen = set()
+        # The solutions are processed while they are enumerated, their time is not solving time.
+        processing = [0.0]
+
+        def greedy_cb(goal):
+            self.stats.count('greedy_enumerated')
+            # Alternatives often lead to the same install set - it adds nothing the second time.
+            fingerprint = frozenset(self.index.ids[hpo] for hpo in goal.list_installs())
+            if fingerprint in seen:
+                self.stats.count('greedy_duplicates')
+                return
+            if ((max_solutions is not None and len(seen) >= max_solutions) or
+                    (budget is not None and self.greedy_solutions >= budget)):
+                raise _SolutionLimit()
+            seen.add(fingerprint)
+            self.greedy_solutions += 1
+            start = time.time()
+            try:
+                callback(goal)
+            finally:
+                elapsed = time.time() - start
+                self.stats.add_time('process', elapsed)
+                processing[0] += elapsed
+
+        start = time.time()
+        try:
+            goal.run_all(greedy_cb)
+        except _SolutionLimit:
+            self.log.debug('%s: solutions truncated after %d', self.last_request, len(seen))
+            self.stats.count('greedy_truncated')
+        finally:
+            self.stats.add_time('solve', time.time() - start - processing[0])
+
+    def is_recorded(self, kind, key):
+        return (kind, key) in self.replay
+
+    def _get_recorded(self, kind, key):
+        entry = self.replay.get((kind, key))
+        if entry is None and kind == self.BUILDDEPS and self.closures is not None:
+            entry = self.closures.get(key)
+        if entry is None:
+            return None
+
+        solutions = [[self.index.get_package(nevra, reponame) for nevra, reponame in installs]
+                     for installs in entry['solutions']]
+        if not all(all(installs) for installs in solutions):
+            return None
+        return solutions, entry['problems']
+
+    def run(self, kind, key, goal):
+        self._kind = kind
+        try:
+            return self._run(kind, key, goal)
+        finally:
+            self._kind = self.REQUEST
+
+    def _run(self, kind, key, goal):
+        recorded = self._get_recorded(kind, key)
+        if recorded:
+            solutions, problems = recorded
+            self.log.debug('%s: replaying recorded solutions', key)
+            for installs in solutions:
+                self.new_solution_cb(Solution(goal.install_requests, installs))
+            self.replayed += 1
+            self.stats.count('replayed')
+        else:
+            solutions = []
+
+            def callback(goal):
+                solutions.append(goal.list_installs())
+                self.new_solution_cb(goal)
+
+            problems = self.solve(goal, callback)
+            if kind == self.BUILDDEPS and self.closures is not None:
+                self.closures[key] = dict(solutions=[[(str(hpo), hpo.reponame) for hpo in installs]
+                                                     for installs in solutions],
+                                          problems=problems)
+
+        self.record(kind, key, solutions, problems)
+        return problems
+
+    def record(self, kind, key, solutions, problems):
+        self.solutions[(kind, key)] = (solutions, problems)
+
+    def enqueue(self, kind, hpo, cause):
+        if (kind, hpo) in self._queued:
+            return
+        self._queued.add((kind, hpo))
+        self._causes[(kind, hpo)] = cause
+        self._queue.append((kind, hpo))
+        self.stats.count('queued')
+        self.max_queue_depth = max(len(self._queue), self.max_queue_depth)
+
+    def process_queue(self):
+        start = time.time()
+        processed = 0
+        while self._queue:
+            kind, hpo = self._queue.popleft()
+            cause = self._causes.pop((kind, hpo))
+            if self.is_skipped(hpo) or (kind == self.SUBPACKAGE and hpo in self.data):
                 continue
-            select = hawkey.Selector(self.sack)
-            select.set(name=po.name, arch=po.arch)
-            select.request = po
-            selectors.append(select)
-        return selectors
+
+            goal = Goal(self.sack)
+            if kind == self.BUILDDEPS:
+                goal.install(hpo)
+            else:
+                select = hawkey.Selector(self.sack)
+                select.set(name=hpo.name, arch=hpo.arch)
+                select.request = hpo
+                goal.install(select)
+            self._cause = cause
+            problems = self.run(kind, self.get_key(hpo), goal)
+            self._cause = None
+            processed += 1
+
+            if problems:
+                if kind == self.BUILDDEPS:
+                    self.log.error('encountered errors when getting builddeps for %s', hpo)
+                else:
+                    self.log.error('encountered errors when adding subpackage %s', hpo)
+                map(self.log.error, problems)
+                self._problems.add(hpo)
+
+            if self.checkpoint_cb:
+                self.checkpoint_cb()
+
+        if processed:
+            elapsed = time.time() - start
+            self.processed += processed
+            self.process_time += elapsed
+            self.log.debug('processed %d queued requests in %.2fs, max queue depth %d',
+                           processed, elapsed, self.max_queue_depth)
+
+    def _get_package(self, entry):
+        nevra, reponame = entry
+        hpo = self.index.get_package(nevra, reponame)
+        if hpo is None:
+            raise ValueError("Package '%s' from '%s' not in the sack" % (nevra, reponame))
+        return hpo
+
+    def get_solutions(self):
+        solutions = {}
+        for (kind, key), (installs, problems) in self.solutions.items():
+            solutions.setdefault(kind, {})[key] = dict(
+                solutions=[[(str(hpo), hpo.reponame) for hpo in packages] for packages in installs],
+                problems=problems)
+        return solutions
+
+    def get_state(self):
+        # Everything needed to continue the run, packages as NEVRA and repo id pairs.
+        return dict(data=[(str(hpo), hpo.reponame) for hpo in self.data],
+                    problems=[(str(hpo), hpo.reponame) for hpo in self._problems],
+                    solved=sorted(self._solved),
+                    queue=[(kind, str(hpo), hpo.reponame, self._causes[(kind, hpo)]) for kind, hpo in self._queue],
+                    queued=sorted((kind, str(hpo), hpo.reponame) for kind, hpo in self._queued),
+                    solutions=self.get_solutions(),
+                    provenance=self.provenance.packages,
+                    greedy_solutions=self.greedy_solutions)
+
+    def set_state(self, state):
+        # Raises ValueError when a package is not in the sack - the state is then of other repositories.
+        assert self.index
+
+        data = PackageSet(self.index)
+        for entry in state['data']:
+            data.add(self._get_package(entry))
+        problems = PackageSet(self.index)
+        for entry in state['problems']:
+            problems.add(self._get_package(entry))
+        queue = deque()
+        causes = {}
+        for kind, nevra, reponame, cause in state['queue']:
+            hpo = self._get_package((nevra, reponame))
+            queue.append((kind, hpo))
+            causes[(kind, hpo)] = cause
+        queued = set((kind, self._get_package((nevra, reponame))) for kind, nevra, reponame in state['queued'])
+        solutions = {}
+        for kind, entries in state['solutions'].items():
+            for key, entry in entries.items():
+                solutions[(kind, key)] = ([map(self._get_package, installs) for installs in entry['solutions']],
+                                          entry['problems'])
+
+        self.data = data
+        self._problems = problems
+        self._solved = set(solved if isinstance(solved, basestring) else tuple(solved) for solved in state['solved'])
+        self._queue = queue
+        self._causes = causes
+        self._queued = queued
+        self.solutions = solutions
+        self.provenance = Provenance(packages=dict((key, tuple(value)) for key, value in state['provenance'].items()))
+        self.greedy_solutions = state['greedy_solutions']
+
+    @property
+    def throughput(self):
+        return self.processed / self.process_time if self.process_time else 0.0
 
     def new_solution_cb(self, goal):
-        # Save the new install request.
-        self._active_requests.append(goal.install_requests_as_strings)
-        self._max_requests = max(len(self.active_requests), self.max_requests)
+        self.stats.count('solutions')
+        self._request = goal.install_requests_as_strings
         # Resolve the solution.
         self._new_solution_cb(goal)
         # Mark the request as solved.
-        solved = self._active_requests.pop()
+        solved = self._request
         self.log.debug('%s: request solved' % solved)
         self._solved.add(solved[0] if len(solved) == 1 else tuple(solved))
 
@@ -180,102 +666,82 @@ class Accumulator(object):
         assert self.sack
 
         # Get the new packages.
-        new_packages = set(goal.list_installs()) - self.data
+        new_packages = set(self.data.difference(goal.list_installs()))
         if not new_packages:
             self.log.debug('%s: no new packages to add', self.last_request)
             return
 
         # Check if some of the packages should not be excluded.
-        for hpo in new_packages:
-            for expo in self.excludes:
-                if hpo.name == expo.name and (hpo.arch == expo.arch or expo.arch is None):
-                    self.log.warning("%s: package '%s' in exclude list", self.last_request, hpo)
-                    return
+        excluded = self.get_excluded(new_packages)
+        if excluded:
+            self.log.warning("%s: package '%s' in exclude list", self.last_request, excluded)
+            return
 
         # Remove the source packages if we don't want them.
         if not self.options.get('source'):
             new_packages = set(hpo for hpo in new_packages if hpo.arch != 'src')
 
         # Add the new packages to the set.
-        self.data |= new_packages
+        reason = self.REASONS[self._kind]
+        cause = ','.join(sorted(self.last_request)) if self._kind == self.REQUEST else self._cause
+        for hpo in sorted(new_packages):
+            self.add(hpo, reason, cause)
 
         # Add the related packages.
         for hpo in sorted(new_packages):
-            self.log.debug('added %s', hpo)
-
             # Source rpm.
-            srpm = set(self._get_srpm(hpo)) - self.data
+            srpm = self.data.difference(self._get_srpm(hpo))
             if srpm:
-                srpm, = srpm  # Extract the only item - this should always be a set of one.
+                srpm, = srpm  # Extract the only item - this should always be a list of one.
                 if self.options.get('source'):
-                    self.data.add(srpm)
-                    self.log.debug('added srpm %s', srpm)
+                    self.add(srpm, self.SRPM, self.get_key(hpo))
 
                 # Builddeps.
-                if self.options.get('selfhosting') and srpm not in self.skiplist:
-                    builddeps_goal = Goal(self.sack)
-                    builddeps_goal.install(srpm)
-                    builddeps_acc = self.update(self, builddeps_goal)
-                    new_builddeps = builddeps_acc.data - self.data
-                    self.data |= new_builddeps
-                    for builddep in sorted(new_builddeps):
-                        self.log.debug('added builddep %s', builddep)
-                    if builddeps_goal.problems:
-                        self.log.error('encountered errors when getting builddeps for %s', srpm)
-                        map(self.log.error, builddeps_goal.problems)
-                        self._problems.add(srpm)
+                if self.options.get('selfhosting') and not self.is_skipped(srpm):
+                    self.enqueue(self.BUILDDEPS, srpm, self.get_key(hpo))
 
             # Debuginfo.
             if self.options.get('debuginfo'):
-                debuginfo = set(self._get_debuginfo(hpo)) - self.data
+                debuginfo = self.data.difference(self._get_debuginfo(hpo))
                 if debuginfo:
-                    for d in debuginfo:
-                        self.data.add(d)
-                        self.log.debug('added debuginfo %s', d)
+                    for d in sorted(debuginfo):
+                        self.add(d, self.DEBUGINFO, self.get_key(hpo))
 
             # Subpackages.
             if self.options.get('fulltree'):
-                subpackages = self._get_subpackages(hpo)
-                for item in subpackages:
-                    subpackages_goal = Goal(self.sack)
-                    subpackages_goal.install(item)
-                    subpackages_acc = self.update(self, subpackages_goal)
-                    new_subpackages = subpackages_acc.data - self.data
-                    self.data |= new_subpackages
-                    for subpackage in sorted(new_subpackages):
-                        self.log.debug('added subpackage %s', subpackage)
-                    if subpackages_goal.problems:
-                        self.log.error('encountered errors when adding subpackage %s', item.request)
-                        map(self.log.error, subpackages_goal.problems)
-                        self._problems.add(item.request)
-
-    @property
-    def active_requests(self):
-        return self._active_requests
+                for item in self._get_subpackages(hpo):
+                    self.enqueue(self.SUBPACKAGE, item, self.get_key(hpo))
 
     @property
     def last_request(self):
-        return self.active_requests[-1]
+        return self._request
 
     @property
-    def max_requests(self):
-        return self._max_requests
+    def queue_depth(self):
+        return len(self._queue)
+
+    def is_skipped(self, hpo):
+        return hpo in self._problems or hpo in self._solved
 
     @property
     def skiplist(self):
-        return self._problems | self._solved
+        return set(self._problems) | self._solved
 
 
 class ALDA(object):
 
+    # max_solutions caps the greedy solutions of a goal, max_greedy_solutions those of a run - goals
+    # after it are solved for a single solution.
     DEFAULT_OPTIONS = dict(greedy=False,
                            source=True,
                            selfhosting=False,
                            debuginfo=True,
-                           fulltree=False)
+                           fulltree=False,
+                           max_solutions=None,
+                           max_greedy_solutions=None)
 
     @staticmethod
-    def get_repo_metadata(reponame, repopath):
+    def get_repo_metadata(reponame, repopath, yumdlist=('primary', 'filelists')):
         repo_handle = librepo.Handle()
         repo_result = librepo.Result()
 
@@ -297,7 +763,7 @@ class ALDA(object):
         # Set the repository type.
         repo_handle.setopt(librepo.LRO_REPOTYPE, librepo.LR_YUMREPO)
         # Download primary.xml and filelists.xml - repomd.xml is downloaded automatically.
-        repo_handle.setopt(librepo.LRO_YUMDLIST, ['primary', 'filelists'])
+        repo_handle.setopt(librepo.LRO_YUMDLIST, list(yumdlist))
 
         repo_handle.perform(repo_result)
         return repo_result.getinfo(librepo.LRR_YUM_REPO), destdir
@@ -307,58 +773,514 @@ class ALDA(object):
         repo = hawkey.Repo(reponame)
         repo.repomd_fn = repoinfo['repomd']
         repo.primary_fn = repoinfo['primary']
-        repo.filelists_fn = repoinfo['filelists']
+        repo.filelists_fn = repoinfo.get('filelists')
         return repo
 
-    def __init__(self, repodict, options=None):
+    def __init__(self, repodict, options=None, cache=None):
         self.log = logging.getLogger('alda.ALDA')
         self.repodict = repodict
+        self.cache = cache
         self.metadirs = []
         self.options = self.DEFAULT_OPTIONS.copy()
         if options:
             self.options.update(options)
 
         self.sack = None
-        self._installs = Accumulator(self.options)
+        self.arch = None
+        self.fingerprint = None
+        # Set while only primary.xml is loaded and filelists are loaded when needed.
+        self.lazy_filelists = False
+        self._load_args = {}
+        # Builddeps closures by closures_key, shared with every resolution of the loaded sack.
+        self._closures = {}
+        self._closures_lock = threading.Lock()
+        self.stats = Stats()
+        self._installs = Accumulator(self.options, self.stats)
         self._problems = set()
-
-    def load_sack(self, arch=None, load_filelists=True, build_cache=True):
-        hawkey_repos = []
-        for name, path in self.repodict.items():
+        self._missing = set()
+        self._requested = set()
+        # Requests resolved so far, saved to the checkpoint file every checkpoint_interval seconds.
+        self._done = set()
+        self._run_key = None
+        self.checkpoint_filename = None
+        self.checkpoint_interval = 300
+        self._checkpoint_time = 0
+
+    def get_repos_metadata(self, jobs=1, yumdlist=('primary', 'filelists')):
+        def download(item):
+            name, path = item
+            if self.cache and (path.startswith('http://') or path.startswith('ftp://')):
+                return self.cache.get_repo_metadata(reponame=name, repopath=path, yumdlist=yumdlist)
             self.log.info('downloading repo metadata from %s' % path)
-            repoinfo, metadir = self.get_repo_metadata(reponame=name, repopath=path)
-            repo = self.get_hawkey_repo(reponame=name, repoinfo=repoinfo)
-            hawkey_repos.append(repo)
-            self.metadirs.append(metadir) if metadir else None
+            return self.get_repo_metadata(reponame=name, repopath=path, yumdlist=yumdlist)
+
+        items = self.repodict.items()
+        downloaded = self.cache.downloaded if self.cache else 0
+        with self.stats.timer('download'):
+            if jobs > 1 and len(items) > 1:
+                pool = ThreadPool(min(jobs, len(items)))
+                try:
+                    results = pool.map(download, items)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                results = map(download, items)
+
+        if self.cache:
+            self.stats.count('bytes_downloaded', self.cache.downloaded - downloaded)
+        self.stats.count('bytes_downloaded', sum(du(metadir) for _repoinfo, metadir in results if metadir))
+        return [(name, repoinfo, metadir) for (name, _path), (repoinfo, metadir) in zip(items, results)]
+
+    def download_metadata(self, jobs=1, yumdlist=('primary', 'filelists')):
+        metadata = self.get_repos_metadata(jobs=jobs, yumdlist=yumdlist)
+        self.metadirs.extend(metadir for _name, _repoinfo, metadir in metadata if metadir)
+        return metadata
+
+    def load_sack(self, arch=None, load_filelists=True, build_cache=True, jobs=1, metadata=None,
+                  lazy_filelists=False):
+        # Kept to load the filelists later on.
+        self._load_args = dict(arch=arch, build_cache=build_cache, jobs=jobs, metadata=metadata)
+        self.lazy_filelists = lazy_filelists
+        if lazy_filelists:
+            load_filelists = False
+
+        # Metadata downloaded elsewhere, e.g. once for several arches, stays with whoever downloaded it.
+        if metadata is None:
+            metadata = self.download_metadata(jobs=jobs, yumdlist=('primary', 'filelists') if load_filelists else ('primary',))
+
+        hawkey_repos = [self.get_hawkey_repo(reponame=name, repoinfo=repoinfo)
+                        for name, repoinfo, _metadir in sorted(metadata, key=lambda item: item[0])]
+        sack_args = dict(arch=arch) if arch else {}
+        if self.cache:
+            sack_args.update(cachedir=self.cache.get_solvdir(arch), make_cache_dir=True)
+        sack = hawkey.Sack(**sack_args)
+
+        def load():
+            for repo in hawkey_repos:
+                sack.load_yum_repo(repo, load_filelists=load_filelists, build_cache=build_cache)
+
+        if self.cache:
+            # Processes sharing the cache must not rewrite the solv files under each other.
+            with flock('%s.lock' % self.cache.get_solvdir(arch)):
+                with self.stats.timer('load_sack'):
+                    load()
+            self.cache.clean()
+            self.cache.release()
+        else:
+            with self.stats.timer('load_sack'):
+                load()
+        self.stats.count('repos_loaded', len(hawkey_repos))
+        self.set_sack(sack, arch, self.get_fingerprint(arch, metadata))
+
+    @staticmethod
+    def get_fingerprint(arch, metadata):
+        # Identifies the loaded metadata - anything computed from the sack can be reused while it stays the same.
+        fingerprint = hashlib.sha256(arch or '')
+        for name, repoinfo, _metadir in sorted(metadata, key=lambda item: item[0]):
+            fingerprint.update('%s:%s\n' % (name, checksum(repoinfo['repomd'])))
+        return fingerprint.hexdigest()
+
+    def set_sack(self, sack, arch=None, fingerprint=None, index=None):
+        # A sack loaded elsewhere can be shared, it is never modified here.
+        self.sack = sack
+        self.arch = arch
+        self.fingerprint = fingerprint
+        self._installs.set_sack(self.sack, index)
+        self.set_closures(self.get_closures(self.closures_key))
+
+    def get_closures(self, key):
+        with self._closures_lock:
+            if key not in self._closures:
+                self._closures[key] = self.cache.get_closures(key) if self.cache else ClosureCache()
+            return self._closures[key]
+
+    def set_closures(self, closures):
+        self._installs.set_closures(closures)
+
+    def new_resolution(self, options=None, index=None):
+        # A new ALDA sharing the loaded sack and its index, with options overriding these. It
+        # resolves on its own, so several can run at once, e.g. in threads. Closures are shared.
+        # The index of a part of the sack can be given instead, e.g. with some repositories disabled.
+        assert self.sack
+
+        # Loading the filelists replaces the sack, so every resolution would load its own.
+        if self.lazy_filelists:
+            raise ValueError('A sack loaded with lazy filelists cannot be shared')
+
+        alda_ = ALDA(self.repodict, dict(self.options, **(options or {})), self.cache)
+        alda_._closures = self._closures
+        alda_._closures_lock = self._closures_lock
+        alda_.set_sack(self.sack, self.arch, self.fingerprint, index or self.index)
+        return alda_
+
+    def resolve_many(self, resolutions, jobs=4):
+        # Every resolution is a dict of resolve_dependencies() arguments and the options of
+        # new_resolution(). They are resolved in a thread pool, returns their ALDAs in order.
+        if self.lazy_filelists:
+            raise ValueError('A sack loaded with lazy filelists cannot be shared')
+
+        def resolve(resolution):
+            resolution = dict(resolution)
+            alda_ = self.new_resolution(resolution.pop('options', None))
+            alda_.resolve_dependencies(**resolution)
+            return alda_
+
+        if jobs < 2 or len(resolutions) < 2:
+            return map(resolve, resolutions)
+        pool = ThreadPool(min(jobs, len(resolutions)))
+        try:
+            return pool.map(resolve, resolutions)
+        finally:
+            pool.close()
+            pool.join()
+
+    def load_filelists(self):
+        assert self.lazy_filelists
+
+        self.log.info('loading filelists')
+        self.stats.count('filelists_loads')
+        self.cleanup()
+        replay = self._installs.replay
+        added_cb = self._installs.added_cb
+        checkpoint_cb = self._installs.checkpoint_cb
+        self._installs = Accumulator(self.options, self.stats)
+        self._installs.set_replay(replay)
+        self._installs.set_added_cb(added_cb)
+        self._installs.set_checkpoint_cb(checkpoint_cb)
+        self._problems = set()
+        self._missing = set()
+        self._done = set()
+        # Metadata given to load_sack() holds primary.xml only, the filelists are downloaded now.
+        self.load_sack(**dict(self._load_args, metadata=None))
+
+    def get_unresolved_files(self):
+        # File requires that nothing in the loaded metadata provides, with the packages requiring them.
+        query = hawkey.Query(self.sack)
+        query.run()
+        self.stats.count('queries')
+        provided = set()
+        requires = {}
+        for hpo in query.result:
+            provided.update(getattr(hpo, 'files', None) or [])
+            provided.update(reldep_name(reldep) for reldep in hpo.provides)
+            for reldep in hpo.requires:
+                name = reldep_name(reldep)
+                if name.startswith('/'):
+                    requires.setdefault(name, set()).add(hpo)
+        return dict((path, packages) for path, packages in requires.items() if path not in provided)
+
+    def needs_filelists(self):
+        unresolved = self.get_unresolved_files()
+        if not unresolved:
+            return False
+
+        # Packages requiring a file from filelists.xml cannot be installed without it. The result
+        # is the same only if none of them failed a goal, could have satisfied a dependency or
+        # could have been picked instead of another version of a package installed or requested.
+        if self._problems or self._installs._problems:
+            return True
+        hidden = set()
+        for packages in unresolved.values():
+            for hpo in packages:
+                hidden.add(hpo.name)
+                hidden.update(reldep_name(reldep) for reldep in hpo.provides)
+        if any(package.name in hidden for package in self._requested):
+            return True
+        for installs, _problems in self._installs.solutions.values():
+            for packages in installs:
+                for hpo in packages:
+                    if hpo.name in hidden or any(reldep_name(reldep) in hidden for reldep in hpo.requires):
+                        return True
+        return False
 
-        self.sack = hawkey.Sack(arch=arch) if arch else hawkey.Sack()
-        for repo in hawkey_repos:
-            self.sack.load_yum_repo(repo, load_filelists=load_filelists, build_cache=build_cache)
-        self._installs.set_sack(self.sack)
+    @property
+    def greedy_limits(self):
+        if not self.options.get('greedy'):
+            return [None, None]
+        return [self.options.get('max_solutions'), self.options.get('max_greedy_solutions')]
 
-    def resolve_dependencies(self, packages, excludes=None):
+    @property
+    def closures_key(self):
+        key = '%s-greedy' % self.fingerprint if self.options.get('greedy') else self.fingerprint
+        if self.options.get('greedy') and any(self.greedy_limits):
+            key = '%s-%s-%s' % ((key,) + tuple(self.greedy_limits))
+        # Closures solved without filelists are not valid with them.
+        return '%s-primary' % key if self.lazy_filelists else key
+
+    def _resolve(self, requests):
+        if len(requests) > 1:
+            goal = Goal(self.sack)
+            for _package, ps in requests:
+                goal.install(ps.selector)
+            # A batch is accepted only as a whole, so anything that would reject a single
+            # request - solver problems or an excluded package - splits the batch instead.
+            self.stats.count('goals')
+            with self.stats.timer('solve'):
+                solved = goal.run()
+            if (solved and not self._installs.get_excluded(self._installs.data.difference(goal.list_installs()))
+                    and self.is_batch_safe(goal)):
+                # Not recorded - the install set of a batch is not the solution of any one of its
+                # requests, so runs replaying solutions solve batched requests again.
+                with self.stats.timer('process'):
+                    self._installs.new_solution_cb(goal)
+                self._installs.process_queue()
+                return
+
+            self.log.debug('%d requests: batch not solvable as a whole, splitting', len(requests))
+            half = len(requests) // 2
+            self._resolve(requests[:half])
+            self._resolve(requests[half:])
+            return
+
+        (package, ps), = requests
+        goal = Goal(self.sack)
+        goal.install(ps.selector)
+        problems = self._installs.run(Accumulator.REQUEST, str(package), goal)
+        self._installs.process_queue()
+        if problems:
+            self.log.error('encountered errors when getting dependencies for %s', str(package))
+            map(self.log.error, problems)
+            self._problems.add(package)
+
+    def set_previous(self, manifest, sack=None, changes=None):
+        # The changes since the previous run are found from its sack, unless they are given.
+        assert self.sack
+
+        if (manifest['arch'] != self.arch or manifest['greedy'] != bool(self.options.get('greedy')) or
+                manifest.get('greedy_limits', [None, None]) != self.greedy_limits):
+            self.log.warning('previous run used a different arch or greedy mode, not reusing it')
+            return
+
+        if changes is None and manifest['fingerprint'] != self.fingerprint:
+            if sack is None:
+                raise ValueError('The repositories changed since the previous run and its sack was not given')
+            changes = Changes.from_sacks(sack, self.sack)
+            # A query of each sack.
+            self.stats.count('queries', 2)
+        if changes is not None:
+            self.log.info('%d package names changed since the previous run', len(changes.names))
+
+        replay = manifest.get_replay(self._installs.index, changes)
+        self.log.info('reusing %d of %d solutions from the previous run', len(replay),
+                      sum(len(entries) for entries in manifest['solutions'].values()))
+        self._installs.set_replay(replay)
+
+    def set_checkpoint(self, filename, interval=300):
+        # The state is saved every interval seconds while resolving, and resolving the same
+        # packages against the same repositories again continues from it.
+        self.checkpoint_filename = filename
+        self.checkpoint_interval = interval
+        self._installs.set_checkpoint_cb(self.checkpoint)
+
+    def checkpoint(self, force=False):
+        if not self.checkpoint_filename or self._run_key is None:
+            return
+        now = time.time()
+        if not force and now - self._checkpoint_time < self.checkpoint_interval:
+            return
+
+        with self.stats.timer('checkpoint'):
+            Checkpoint(version=Checkpoint.VERSION,
+                       key=self.closures_key,
+                       arch=self.arch,
+                       run=self._run_key,
+                       done=sorted(self._done),
+                       problems=sorted(self._problems),
+                       state=self._installs.get_state()).save(self.checkpoint_filename)
+        self.stats.count('checkpoints')
+        self._checkpoint_time = now
+        self.log.debug('checkpoint saved, %d requests done, %d queued', len(self._done), self._installs.queue_depth)
+
+    def restore_checkpoint(self):
+        if not self.checkpoint_filename or not os.path.exists(self.checkpoint_filename):
+            return False
+
+        try:
+            checkpoint = Checkpoint.load(self.checkpoint_filename)
+            if (checkpoint['key'], checkpoint['arch'], checkpoint['run']) != (self.closures_key, self.arch, self._run_key):
+                self.log.warning('checkpoint is of other packages or repositories, starting over')
+                return False
+            self._installs.set_state(checkpoint['state'])
+        except (ValueError, KeyError) as e:
+            self.log.warning('cannot continue from the checkpoint, starting over: %s', e)
+            return False
+
+        self._done = set(checkpoint['done'])
+        self._problems = set(Package(name, arch) for name, arch in checkpoint['problems'])
+        self.log.info('continuing from the checkpoint, %d requests done, %d queued',
+                      len(self._done), self._installs.queue_depth)
+        return True
+
+    def is_batch_safe(self, goal):
+        # Solved together, a request can get another provider of a capability than it would
+        # alone - the one another request of the batch installs - or an older version that
+        # avoids a conflict. Batches where neither choice exists give the per-request result.
+        index = self._installs.index
+        for hpo in goal.list_installs():
+            if not index.is_newest(hpo):
+                return False
+            for reldep in hpo.requires:
+                if len(index.get_provider_names(reldep_name(reldep))) > 1:
+                    return False
+        return True
+
+    def remove_checkpoint(self):
+        if self.checkpoint_filename and os.path.exists(self.checkpoint_filename):
+            os.unlink(self.checkpoint_filename)
+
+    def _get_batches(self, requests, batch_size):
+        batch = []
+        for package, ps in requests:
+            # Requests with a solution from the previous run are replayed one by one, and
+            # requests for an arch are not batched - another request could pull in the other one.
+            if package.arch is not None or self._installs.is_recorded(Accumulator.REQUEST, str(package)):
+                yield [(package, ps)]
+                continue
+            batch.append((package, ps))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def expand(self, packages):
+        # Globs are expanded to the packages they match. Returns them with the packages not found.
+        index = self._installs.index
+        expanded = set()
+        missing = set()
+        for package in packages:
+            if package.is_glob:
+                matches = index.expand(package)
+                self.log.debug('%s: matches %d packages', str(package), len(matches))
+                expanded |= matches
+                if not matches:
+                    missing.add(package)
+            elif index.has_package(package.name, package.arch):
+                expanded.add(package)
+            else:
+                missing.add(package)
+        return expanded, missing
+
+    def resolve_dependencies(self, packages, excludes=None, batch_size=1):
         assert self.sack
 
         if excludes:
             self._installs.set_excludes(excludes)
 
-        for package in packages:
-            self.log.info('resolving dependencies for %s', str(package))
-            ps = PackageSelector(package, self.sack)
-            if not ps.query.count():
-                self.log.warning('%s: package not found', str(package))
-                continue
+        if batch_size > 1 and self.options.get('greedy'):
+            # Enumerating all solutions of a batch would multiply the alternatives of its requests.
+            self.log.debug('greedy mode, not batching requests')
+            batch_size = 1
+
+        expanded, missing = self.expand(packages)
+        self._requested = expanded
+        if missing:
+            self.log.warning('%d packages not found: %s', len(missing), ', '.join(sorted(map(str, missing))))
+            self._missing |= missing
+
+        # Only the first pass continues from a checkpoint, not the one after loading filelists.
+        if self._run_key is None:
+            self._run_key = get_run_key(self.options, packages, excludes)
+            self.restore_checkpoint()
+        self._checkpoint_time = time.time()
+        requests = [(package, PackageSelector(package, self.sack)) for package in expanded
+                    if str(package) not in self._done]
+
+        with self.stats.timer('resolve'):
+            # Whatever was queued when the checkpoint was saved comes first.
+            self._installs.process_queue()
+            for batch in self._get_batches(requests, batch_size):
+                self.log.info('resolving dependencies for %s', ', '.join(str(package) for package, _ps in batch))
+                self._resolve(batch)
+                self._done.update(str(package) for package, _ps in batch)
+                self.checkpoint()
+        self.stats['max_queue_depth'] = max(self.stats.get('max_queue_depth', 0), self._installs.max_queue_depth)
+
+        if self._installs.processed:
+            self.log.info('processed %d builddeps and subpackage requests (%.1f/s), max queue depth %d',
+                          self._installs.processed, self._installs.throughput, self._installs.max_queue_depth)
+
+        if self.options.get('greedy'):
+            counters = self.stats.counters
+            self.log.info('enumerated %d greedy solutions, %d duplicates skipped, %d goals truncated',
+                          counters.get('greedy_enumerated', 0), counters.get('greedy_duplicates', 0),
+                          counters.get('greedy_truncated', 0))
+
+        if self._installs.closures.path:
+            self._installs.closures.save()
+
+        if self.lazy_filelists and self.needs_filelists():
+            self.load_filelists()
+            return self.resolve_dependencies(packages, excludes, batch_size)
+
+        self.remove_checkpoint()
+
+    def resolve_parallel(self, packages, excludes=None, batch_size=1, processes=2):
+        # Shards of the requests are solved in forked worker processes sharing the sack and the
+        # builddeps closures. The run is then replayed from their solutions in the order of a
+        # serial run, so the result is the same as resolve_dependencies() gives. With batches the
+        # requests are solved again, in the batches of the serial run.
+        global _sharding
+        assert self.sack
 
-            goal = Goal(self.sack)
-            goal.install(ps.selector)
-            self._installs = Accumulator.update(self._installs, goal)
-            if goal.problems:
-                self.log.error('encountered errors when getting dependencies for %s', str(package))
-                map(self.log.error, goal.problems)
-                self._problems.add(package)
-
-        # Cleanup.
+        # Filelists loaded halfway and the greedy budget of a run depend on the whole run.
+        if processes < 2 or self.lazy_filelists or self.options.get('max_greedy_solutions') is not None:
+            self.log.debug('resolving serially')
+            return self.resolve_dependencies(packages, excludes, batch_size)
+
+        requests = sorted(self.expand(packages)[0])
+        shards = filter(None, [set(requests[i::processes]) for i in range(processes)])
+        if len(shards) < 2:
+            return self.resolve_dependencies(packages, excludes, batch_size)
+
+        manager = multiprocessing.Manager()
+        try:
+            closures = manager.dict(self._installs.closures.items())
+            # The workers are forked when the pool is created, they keep the ALDA they saw then.
+            with _sharding_lock:
+                _sharding = self
+                try:
+                    pool = multiprocessing.Pool(len(shards))
+                finally:
+                    _sharding = None
+            try:
+                with self.stats.timer('shards'):
+                    results = pool.map(_resolve_shard, [(shard, excludes, batch_size, closures) for shard in shards])
+            finally:
+                pool.close()
+                pool.join()
+            self._installs.closures.update(closures.items())
+        finally:
+            manager.shutdown()
+
+        replay = dict(self._installs.replay)
+        for solutions, stats in results:
+            self.stats.merge(stats)
+            for kind, entries in solutions.items():
+                # A replayed request is never batched, it would change the batches.
+                if kind == Accumulator.REQUEST and batch_size > 1:
+                    continue
+                for key, entry in entries.items():
+                    replay[(kind, key)] = entry
+        self.log.info('solved %d goals in %d shards', len(replay) - len(self._installs.replay), len(shards))
+        self._installs.set_replay(replay)
+        self.resolve_dependencies(packages, excludes, batch_size)
+
+    def cleanup(self):
+        # Removes the downloaded metadata - the loaded sack stays usable for more resolutions.
         map(shutil.rmtree, self.metadirs)
+        self.metadirs = []
+        if self.cache:
+            self.cache.release()
+
+    @property
+    def index(self):
+        return self._installs.index
+
+    @property
+    def provenance(self):
+        return self._installs.provenance
 
     @property
     def arches(self):
@@ -373,10 +1295,57 @@ class ALDA(object):
     def installs_as_strings(self):
         return map(str, self.installs)
 
+    def get_url(self, hpo):
+        return os.path.join(self.repodict[hpo.reponame], hpo.location)
+
+    def set_added_cb(self, callback):
+        # callback(hpo, reason) is called for every package as soon as it is added.
+        self._installs.set_added_cb(callback)
+
     @property
     def urls(self):
-        return map(lambda po: os.path.join(self.repodict[po.reponame], po.location), self.installs)
+        return map(self.get_url, self.installs)
+
+    @property
+    def fetch_items(self):
+        items = []
+        for hpo in self.installs:
+            chksum_type, chksum = hpo.chksum
+            items.append(fetch.FetchItem(url=self.get_url(hpo), location=hpo.location,
+                                         checksum_type=hawkey.chksum_name(chksum_type),
+                                         checksum=binascii.hexlify(chksum)))
+        return items
+
+    def fetch(self, destdir, jobs=4):
+        # Mirrors the resolved packages into destdir, keeping their repo layout. Returns what failed.
+        with self.stats.timer('fetch'):
+            return fetch.fetch(self.fetch_items, destdir, jobs=jobs, stats=self.stats)
 
     @property
     def problems(self):
         return list(self._problems)
+
+    @property
+    def missing(self):
+        return list(self._missing)
+
+    @property
+    def manifest(self):
+        return Manifest(version=Manifest.VERSION,
+                        fingerprint=self.fingerprint,
+                        arch=self.arch,
+                        greedy=bool(self.options.get('greedy')),
+                        greedy_limits=self.greedy_limits,
+                        solutions=self._installs.get_solutions(),
+                        installs=sorted((str(hpo), hpo.reponame) for hpo in self.installs),
+                        problems=sorted(map(str, self.problems)))
+
+
+def _resolve_shard(args):
+    shard, excludes, batch_size, closures = args
+    parent = _sharding
+    alda_ = parent.new_resolution()
+    alda_.set_closures(SharedClosures(closures))
+    alda_._installs.set_replay(parent._installs.replay)
+    alda_.resolve_dependencies(shard, excludes, batch_size)
+    return alda_._installs.get_solutions(), alda_.stats
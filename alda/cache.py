@@ -0,0 +1,330 @@
+# Copyright (C) 2012  Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Author(s):    Martin Gracik <mgracik@redhat.com>
+#
+
+from contextlib import contextmanager
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import librepo
+
+
+def checksum(filename, algorithm='sha256'):
+    hashobj = hashlib.new(algorithm)
+    with open(filename, 'rb') as fileobj:
+        for chunk in iter(lambda: fileobj.read(1024 * 1024), b''):
+            hashobj.update(chunk)
+    return hashobj.hexdigest()
+
+
+def du(path):
+    size = 0
+    for dirpath, _dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+    return size
+
+
+@contextmanager
+def flock(path, operation=fcntl.LOCK_EX):
+    with open(path, 'a') as fileobj:
+        fcntl.flock(fileobj, operation)
+        try:
+            yield fileobj
+        finally:
+            fcntl.flock(fileobj, fcntl.LOCK_UN)
+
+
+class MetadataCache(object):
+
+    '''
+    On-disk cache of downloaded repository metadata and hawkey solv files.
+
+    Metadata is stored under repos/<url hash>/<repomd.xml checksum>, so a
+    repository is downloaded again only when its repomd.xml changes. An entry
+    can hold primary.xml only, filelists.xml is added to it when needed. Every
+    directory is created under a temporary name and renamed into place, and
+    entries in use are held with a shared lock, so several processes can use
+    the same cache directory at once.
+
+    '''
+
+    def __init__(self, cachedir, max_size=None, max_age=None):
+        self.log = logging.getLogger('alda.MetadataCache')
+        self.cachedir = os.path.abspath(cachedir)
+        self.max_size = max_size
+        self.max_age = max_age
+        self._locks = []
+        # Bytes of metadata downloaded into the cache, repomd.xml checks included.
+        self.downloaded = 0
+        self._downloaded_lock = threading.Lock()
+
+        for dirname in (self.repodir, self.solvdir, self.closuredir):
+            if not os.path.isdir(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+
+    @property
+    def repodir(self):
+        return os.path.join(self.cachedir, 'repos')
+
+    @property
+    def solvdir(self):
+        return os.path.join(self.cachedir, 'solv')
+
+    @property
+    def closuredir(self):
+        return os.path.join(self.cachedir, 'closures')
+
+    def get_solvdir(self, arch=None):
+        return os.path.join(self.solvdir, arch or 'default')
+
+    def get_closures(self, fingerprint):
+        return ClosureCache(os.path.join(self.closuredir, '%s.json' % fingerprint))
+
+    def get_keydir(self, repopath):
+        return os.path.join(self.repodir, hashlib.sha1(repopath.encode('utf-8')).hexdigest())
+
+    @staticmethod
+    def _perform(repopath, destdir=None, yumdlist=('primary', 'filelists')):
+        repo_handle = librepo.Handle()
+        repo_result = librepo.Result()
+
+        repo_handle.setopt(librepo.LRO_URL, repopath)
+        if destdir:
+            repo_handle.setopt(librepo.LRO_DESTDIR, destdir)
+        else:
+            repo_handle.setopt(librepo.LRO_LOCAL, True)
+        repo_handle.setopt(librepo.LRO_REPOTYPE, librepo.LR_YUMREPO)
+        repo_handle.setopt(librepo.LRO_YUMDLIST, list(yumdlist))
+
+        repo_handle.perform(repo_result)
+        return repo_result.getinfo(librepo.LRR_YUM_REPO)
+
+    def _hold(self, entry):
+        # Keep a shared lock on the entry until release() so that no other
+        # process evicts it while the sack is being loaded from it.
+        fileobj = open('%s.lock' % entry, 'a')
+        fcntl.flock(fileobj, fcntl.LOCK_SH)
+        self._locks.append(fileobj)
+
+    def release(self):
+        while self._locks:
+            fileobj = self._locks.pop()
+            fcntl.flock(fileobj, fcntl.LOCK_UN)
+            fileobj.close()
+
+    def _add_downloaded(self, size):
+        # Repositories are downloaded from several threads at once.
+        with self._downloaded_lock:
+            self.downloaded += size
+
+    @staticmethod
+    def get_yumdlist(entry):
+        # The metadata files an entry holds. Entries without the list were all downloaded in full.
+        if not os.path.isdir(entry):
+            return set()
+        try:
+            with open(os.path.join(entry, '.yumdlist')) as fileobj:
+                return set(fileobj.read().split())
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return set(['primary', 'filelists'])
+
+    def _store(self, tmpdir, entry, repoinfo, yumdlist):
+        # A new entry is the download renamed into place, files added to an existing one are moved into it.
+        yumdlist = self.get_yumdlist(entry) | set(yumdlist)
+        if not os.path.isdir(entry):
+            os.rename(tmpdir, entry)
+        else:
+            for name in yumdlist - self.get_yumdlist(entry):
+                path = os.path.join(entry, os.path.relpath(repoinfo[name], tmpdir))
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                os.rename(repoinfo[name], path)
+        fd, tmpname = tempfile.mkstemp(prefix='.yumdlist.', dir=entry)
+        with os.fdopen(fd, 'w') as fileobj:
+            fileobj.write('\n'.join(sorted(yumdlist)))
+        os.rename(tmpname, os.path.join(entry, '.yumdlist'))
+
+    def get_repo_metadata(self, reponame, repopath, yumdlist=('primary', 'filelists')):
+        keydir = self.get_keydir(repopath)
+        if not os.path.isdir(keydir):
+            try:
+                os.makedirs(keydir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        with flock('%s.lock' % keydir):
+            # Leftovers of interrupted downloads - nobody else can be using them while we hold the lock.
+            for name in os.listdir(keydir):
+                if name.startswith('.'):
+                    shutil.rmtree(os.path.join(keydir, name), ignore_errors=True)
+
+            # Only repomd.xml is downloaded to find out whether the cached copy is current.
+            tmpdir = tempfile.mkdtemp(prefix='.%s.' % reponame, dir=keydir)
+            try:
+                repoinfo = self._perform(repopath, destdir=tmpdir, yumdlist=[])
+                self._add_downloaded(du(tmpdir))
+                entry = os.path.join(keydir, checksum(repoinfo['repomd']))
+                missing = [name for name in yumdlist if name not in self.get_yumdlist(entry)]
+                if not missing:
+                    self.log.info('using cached repo metadata for %s' % repopath)
+                while missing:
+                    self.log.info('downloading %s metadata from %s' % (', '.join(missing), repopath))
+                    if os.path.isdir(tmpdir):
+                        shutil.rmtree(tmpdir)
+                    tmpdir = tempfile.mkdtemp(prefix='.%s.' % reponame, dir=keydir)
+                    repoinfo = self._perform(repopath, destdir=tmpdir, yumdlist=missing)
+                    self._add_downloaded(du(tmpdir))
+                    # The repository could have changed since repomd.xml was checked, then the
+                    # files go to the entry of the new one and it is checked again.
+                    entry = os.path.join(keydir, checksum(repoinfo['repomd']))
+                    self._store(tmpdir, entry, repoinfo, missing)
+                    missing = [name for name in yumdlist if name not in self.get_yumdlist(entry)]
+            finally:
+                if os.path.isdir(tmpdir):
+                    shutil.rmtree(tmpdir)
+
+            self._hold(entry)
+            os.utime(entry, None)
+
+        return self._perform('file://%s' % entry, yumdlist=yumdlist), None
+
+    def get_entries(self):
+        entries = []
+        for key in os.listdir(self.repodir):
+            keydir = os.path.join(self.repodir, key)
+            if not os.path.isdir(keydir):
+                continue
+            for name in os.listdir(keydir):
+                entry = os.path.join(keydir, name)
+                if name.startswith('.') or not os.path.isdir(entry):
+                    continue
+                entries.append((os.stat(entry).st_mtime, du(entry), entry))
+        return sorted(entries)
+
+    def _evict(self, entry):
+        # The key lock keeps other processes from picking the entry up while it is removed.
+        with flock('%s.lock' % os.path.dirname(entry)):
+            with open('%s.lock' % entry, 'a') as fileobj:
+                try:
+                    fcntl.flock(fileobj, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                    self.log.debug('%s: in use, not evicting', entry)
+                    return False
+                shutil.rmtree(entry)
+                os.unlink('%s.lock' % entry)
+                self.log.debug('%s: evicted', entry)
+                return True
+
+    def clean(self):
+        if self.max_size is None and self.max_age is None:
+            return
+
+        with flock(os.path.join(self.cachedir, '.lock')):
+            entries = self.get_entries()
+            total = sum(size for _mtime, size, _entry in entries)
+            now = time.time()
+            for mtime, size, entry in entries:
+                expired = self.max_age is not None and now - mtime > self.max_age
+                oversized = self.max_size is not None and total > self.max_size
+                if (expired or oversized) and self._evict(entry):
+                    total -= size
+
+            if self.max_age is not None:
+                for name in os.listdir(self.closuredir):
+                    path = os.path.join(self.closuredir, name)
+                    if name.endswith('.json') and now - os.stat(path).st_mtime > self.max_age:
+                        os.unlink(path)
+
+
+class ClosureCache(dict):
+
+    '''
+    Builddeps closures of source packages, saved as JSON.
+
+    The file name carries the fingerprint of the loaded repositories, so a
+    file is only ever used with the metadata it was computed from. save()
+    merges with whatever other processes saved in the meantime.
+
+    '''
+
+    def __init__(self, path=None):
+        super(ClosureCache, self).__init__()
+        self.path = path
+        if self.path and os.path.isfile(self.path):
+            self.update(self.read())
+
+    def read(self):
+        try:
+            with open(self.path, 'r') as fileobj:
+                return json.load(fileobj)
+        except (IOError, ValueError):
+            return {}
+
+    def save(self):
+        with flock('%s.lock' % self.path):
+            data = self.read()
+            data.update(self)
+            fd, tmpname = tempfile.mkstemp(prefix='.closures.', dir=os.path.dirname(self.path))
+            with os.fdopen(fd, 'w') as fileobj:
+                json.dump(data, fileobj)
+            os.rename(tmpname, self.path)
+
+
+class SharedClosures(object):
+
+    '''
+    Builddeps closures shared by the processes resolving shards of a run.
+
+    Wraps a multiprocessing.Manager dict, so a closure solved in one process
+    is replayed in all others. It is never saved, the process that started
+    the workers merges it into its own ClosureCache.
+
+    '''
+
+    path = None
+
+    def __init__(self, closures):
+        self.closures = closures
+
+    def get(self, key, default=None):
+        return self.closures.get(key, default)
+
+    def __setitem__(self, key, value):
+        self.closures[key] = value
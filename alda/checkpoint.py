@@ -0,0 +1,60 @@
+# Copyright (C) 2012  Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Author(s):    Martin Gracik <mgracik@redhat.com>
+#
+
+import hashlib
+import json
+import os
+import tempfile
+
+
+def get_run_key(options, packages, excludes):
+    # Identifies what a run resolves, a checkpoint is only resumed by the same run.
+    run = dict(options=options,
+               packages=sorted(map(str, packages)),
+               excludes=sorted(map(str, excludes or ())))
+    return hashlib.sha256(json.dumps(run, sort_keys=True)).hexdigest()
+
+
+class Checkpoint(dict):
+
+    '''
+    The state of an unfinished run.
+
+    Holds the fingerprint of the repositories and the key of the run it was
+    saved by, the requests that are done, and the accumulator state with
+    packages stored as NEVRA and repo id pairs.
+
+    '''
+
+    VERSION = 1
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r') as fileobj:
+            checkpoint = cls(json.load(fileobj))
+        if checkpoint.get('version') != cls.VERSION:
+            raise ValueError("Unsupported checkpoint version in '%s'" % filename)
+        return checkpoint
+
+    def save(self, filename):
+        # Written under a temporary name first, a crash while saving keeps the previous checkpoint.
+        fd, tmpname = tempfile.mkstemp(prefix='.checkpoint.', dir=os.path.dirname(os.path.abspath(filename)))
+        with os.fdopen(fd, 'w') as fileobj:
+            json.dump(self, fileobj)
+        os.rename(tmpname, filename)
@@ -0,0 +1,169 @@
+# Copyright (C) 2012  Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Author(s):    Martin Gracik <mgracik@redhat.com>
+#
+
+from collections import namedtuple
+import logging
+
+from alda import ALDA, Accumulator, SackIndex
+from manifest import Changes, Manifest
+
+
+OLD = 'old'
+NEW = 'new'
+
+
+def get_reponame(side, reponame):
+    return '%s:%s' % (side, reponame)
+
+
+def strip_side(key):
+    # The repo id or repo id/NEVRA key without the side it was loaded for.
+    side, sep, rest = key.partition(':')
+    return rest if sep and side in (OLD, NEW) else key
+
+
+class DiffEntry(namedtuple('DiffEntry', 'change, old, new, why')):
+
+    '''
+    A package that differs between the old and the new result.
+
+    change is added, removed, upgraded, downgraded or rebuilt, old and new
+    are the packages on either side or None, and why is the provenance of
+    the new package, or of the old one if it was removed.
+
+    '''
+
+    __slots__ = ()
+
+
+class Diff(object):
+
+    '''
+    Compares what a package list resolves to in two snapshots of the repositories.
+
+    Both snapshots are loaded into a single sack, their repo ids prefixed
+    with old: and new:, and every side is resolved with the repositories of
+    the other one disabled. Solutions of the old side that no changed package
+    can affect are replayed on the new side instead of being solved again.
+
+    '''
+
+    def __init__(self, old_repodict, new_repodict, options=None, cache=None):
+        self.log = logging.getLogger('alda.Diff')
+        repodict = {}
+        for side, side_repodict in ((OLD, old_repodict), (NEW, new_repodict)):
+            for name, path in side_repodict.items():
+                repodict[get_reponame(side, name)] = path
+        self.alda = ALDA(repodict, options, cache)
+        self.old = None
+        self.new = None
+
+    def load_sack(self, arch=None, jobs=1):
+        self.alda.load_sack(arch=arch, jobs=jobs)
+
+    def cleanup(self):
+        self.alda.cleanup()
+
+    @property
+    def arches(self):
+        return self.alda.arches
+
+    def enable(self, side=None):
+        # Only the repositories of the side are visible to queries and goals, all of them with None.
+        for name in self.alda.repodict:
+            if side is None or name.startswith('%s:' % side):
+                self.alda.sack.enable_repo(name)
+            else:
+                self.alda.sack.disable_repo(name)
+
+    def get_side(self, side):
+        # The index of a side has only its packages. Closures are keyed by repo ids with the
+        # side in them, so a side never uses those of the other - the new side reuses what
+        # the old one solved through its translated manifest only.
+        self.enable(side)
+        return self.alda.new_resolution(index=SackIndex(self.alda.sack))
+
+    @staticmethod
+    def translate(manifest):
+        # The manifest of the old side, with its repo ids moved to the new side.
+        def reponame(name):
+            return get_reponame(NEW, strip_side(name))
+
+        solutions = {}
+        for kind, entries in manifest['solutions'].items():
+            for key, entry in entries.items():
+                if kind != Accumulator.REQUEST:
+                    name, _sep, nevra = key.partition('/')
+                    key = '%s/%s' % (reponame(name), nevra)
+                solutions.setdefault(kind, {})[key] = dict(
+                    solutions=[[(package_nevra, reponame(package_repo)) for package_nevra, package_repo in installs]
+                               for installs in entry['solutions']],
+                    problems=entry['problems'])
+        return Manifest(manifest, solutions=solutions)
+
+    def resolve_dependencies(self, packages, excludes=None, batch_size=1):
+        assert self.alda.sack
+
+        try:
+            self.old = self.get_side(OLD)
+            self.old.resolve_dependencies(packages, excludes, batch_size)
+
+            self.new = self.get_side(NEW)
+            changes = Changes(self.old.index.packages, self.new.index.packages)
+            self.log.info('%d package names differ between the snapshots', len(changes.names))
+            self.new.set_previous(self.translate(self.old.manifest), changes=changes)
+            self.new.resolve_dependencies(packages, excludes, batch_size)
+        finally:
+            self.enable()
+
+    def why(self, alda_, hpo):
+        return [(strip_side(key), reason) for key, reason in alda_.provenance.why(Accumulator.get_key(hpo))]
+
+    @staticmethod
+    def group(packages):
+        # (name, arch) -> packages by NEVRA and checksum
+        groups = {}
+        for hpo in packages:
+            groups.setdefault((hpo.name, hpo.arch), {})[(str(hpo), hpo.chksum)] = hpo
+        return groups
+
+    def get_changes(self):
+        assert self.old and self.new
+
+        old = self.group(self.old.installs)
+        new = self.group(self.new.installs)
+        entries = []
+        for name_arch in sorted(set(old) | set(new)):
+            old_packages = old.get(name_arch, {})
+            new_packages = new.get(name_arch, {})
+            removed = [hpo for key, hpo in sorted(old_packages.items()) if key not in new_packages]
+            added = [hpo for key, hpo in sorted(new_packages.items()) if key not in old_packages]
+
+            # One version replacing another, anything else is reported as added and removed packages.
+            if len(removed) == 1 and len(added) == 1:
+                (old_hpo,), (new_hpo,) = removed, added
+                result = new_hpo.evr_cmp(old_hpo)
+                change = 'upgraded' if result > 0 else 'downgraded' if result < 0 else 'rebuilt'
+                entries.append(DiffEntry(change, old_hpo, new_hpo, self.why(self.new, new_hpo)))
+                continue
+            for hpo in removed:
+                entries.append(DiffEntry('removed', hpo, None, self.why(self.old, hpo)))
+            for hpo in added:
+                entries.append(DiffEntry('added', None, hpo, self.why(self.new, hpo)))
+        return entries
@@ -0,0 +1,160 @@
+# Copyright (C) 2012  Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Author(s):    Martin Gracik <mgracik@redhat.com>
+#
+
+from collections import namedtuple
+import errno
+import fcntl
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+import shutil
+import urllib2
+
+from cache import checksum
+
+
+# FICLONE from linux/fs.h - shares the data blocks of a file on btrfs and xfs.
+FICLONE = 0x40049409
+
+log = logging.getLogger('alda.fetch')
+
+
+class FetchItem(namedtuple('FetchItem', 'url, location, checksum_type, checksum')):
+
+    __slots__ = ()
+
+    @property
+    def local_path(self):
+        if self.url.startswith('file://'):
+            return self.url[len('file://'):]
+        if self.url.startswith('/'):
+            return self.url
+        return None
+
+
+def is_valid(path, item):
+    return os.path.isfile(path) and checksum(path, item.checksum_type) == item.checksum
+
+
+def reflink(src, dest):
+    with open(src, 'rb') as srcobj:
+        with open(dest, 'wb') as destobj:
+            fcntl.ioctl(destobj.fileno(), FICLONE, srcobj.fileno())
+
+
+def link(src, dest):
+    # Hardlink if possible, then reflink, and copy only when both fail.
+    try:
+        os.link(src, dest)
+        return 'linked'
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+    try:
+        reflink(src, dest)
+        return 'reflinked'
+    except IOError:
+        pass
+    shutil.copyfile(src, dest)
+    return 'copied'
+
+
+def download(url, dest, chunk_size=1024 * 1024):
+    # A partial file left by an interrupted download is continued where it stopped.
+    offset = os.path.getsize(dest) if os.path.isfile(dest) else 0
+    request = urllib2.Request(url)
+    if offset:
+        request.add_header('Range', 'bytes=%d-' % offset)
+    try:
+        response = urllib2.urlopen(request)
+    except urllib2.HTTPError as e:
+        # The partial file is already complete, or bigger than the file on the server.
+        if e.code != 416:
+            raise
+        os.unlink(dest)
+        return download(url, dest, chunk_size)
+
+    resumed = offset and response.getcode() == 206
+    size = 0
+    try:
+        with open(dest, 'ab' if resumed else 'wb') as fileobj:
+            for chunk in iter(lambda: response.read(chunk_size), b''):
+                fileobj.write(chunk)
+                size += len(chunk)
+    finally:
+        response.close()
+    return size
+
+
+def fetch_item(item, destdir):
+    dest = os.path.join(destdir, item.location)
+    if not os.path.isdir(os.path.dirname(dest)):
+        try:
+            os.makedirs(os.path.dirname(dest))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    if is_valid(dest, item):
+        return 'present', 0
+
+    partial = '%s.part' % dest
+    if item.local_path:
+        if os.path.exists(partial):
+            os.unlink(partial)
+        how, size = link(item.local_path, partial), 0
+    else:
+        how, size = 'downloaded', download(item.url, partial)
+
+    if not is_valid(partial, item):
+        os.unlink(partial)
+        raise ValueError('checksum mismatch')
+    os.rename(partial, dest)
+    return how, size
+
+
+# A directory must not be fetched into by two runs at once.
+def fetch(items, destdir, jobs=4, stats=None):
+    # The same package can come from several repos or arches, it is fetched once.
+    items = sorted(dict((item.location, item) for item in items).values())
+
+    def run(item):
+        try:
+            how, size = fetch_item(item, destdir)
+        except (IOError, OSError, ValueError, urllib2.URLError) as e:
+            log.error('%s: %s', item.url, e)
+            return item, None, str(e)
+        log.debug('%s: %s', item.location, how)
+        return item, how, size
+
+    pool = ThreadPool(max(1, min(jobs, len(items))))
+    try:
+        results = pool.map(run, items)
+    finally:
+        pool.close()
+        pool.join()
+
+    failed = []
+    for item, how, result in results:
+        if how is None:
+            failed.append((item, result))
+        elif stats is not None:
+            stats.count('fetch_%s' % how)
+            stats.count('bytes_fetched', result)
+    return failed
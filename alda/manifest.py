@@ -0,0 +1,118 @@
+# Copyright (C) 2012  Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Author(s):    Martin Gracik <mgracik@redhat.com>
+#
+
+import json
+
+import hawkey
+
+
+def reldep_name(reldep):
+    return str(reldep).split(' ', 1)[0]
+
+
+class Changes(object):
+
+    '''
+    Packages that differ between two sacks, or two sets of packages.
+
+    A package is identified by its NEVRA and checksum, so a rebuild with the
+    same NEVRA counts as a change too. The repo id does not matter.
+
+    '''
+
+    def __init__(self, old_packages, new_packages):
+        old = self.get_keys(old_packages)
+        new = self.get_keys(new_packages)
+        removed = [old[key] for key in set(old) - set(new)]
+        added = [new[key] for key in set(new) - set(old)]
+
+        self.names = set(hpo.name for hpo in removed + added)
+        # What the added packages could newly satisfy or replace.
+        self.capabilities = set()
+        self.obsoletes = set()
+        for hpo in added:
+            self.capabilities.add(hpo.name)
+            self.capabilities.update(reldep_name(reldep) for reldep in hpo.provides)
+            self.capabilities.update(getattr(hpo, 'files', None) or [])
+            self.obsoletes.update(reldep_name(reldep) for reldep in hpo.obsoletes)
+
+    @classmethod
+    def from_sacks(cls, old_sack, new_sack):
+        return cls(cls.get_packages(old_sack), cls.get_packages(new_sack))
+
+    @staticmethod
+    def get_packages(sack):
+        query = hawkey.Query(sack)
+        query.run()
+        return query.result
+
+    @staticmethod
+    def get_keys(packages):
+        return dict(((str(hpo), hpo.chksum), hpo) for hpo in packages)
+
+    def is_clean(self, kind, key, entry, index):
+        if kind == 'request' and (set([key, key.rpartition('.')[0]]) & (self.names | self.capabilities)):
+            return False
+
+        for installs in entry['solutions']:
+            for nevra, reponame in installs:
+                hpo = index.get_package(nevra, reponame)
+                if hpo is None or hpo.name in self.names or hpo.name in self.obsoletes:
+                    return False
+                if self.capabilities and any(reldep_name(reldep) in self.capabilities for reldep in hpo.requires):
+                    return False
+        return True
+
+
+class Manifest(dict):
+
+    '''
+    The result of a run together with the solutions of every goal it solved.
+
+    Solutions are keyed by the kind of the goal (request, builddeps or
+    subpackage) and the request string or the repo id and NEVRA of the
+    package, and list the installed packages as NEVRA and repo id pairs.
+
+    '''
+
+    VERSION = 1
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r') as fileobj:
+            manifest = cls(json.load(fileobj))
+        if manifest.get('version') != cls.VERSION:
+            raise ValueError("Unsupported manifest version in '%s'" % filename)
+        return manifest
+
+    def save(self, filename):
+        with open(filename, 'w') as fileobj:
+            json.dump(self, fileobj, sort_keys=True)
+
+    def get_replay(self, index, changes=None):
+        replay = {}
+        for kind, entries in self['solutions'].items():
+            for key, entry in entries.items():
+                # Requests that failed are always solved again - the missing piece might be there now.
+                if entry['problems']:
+                    continue
+                if changes is not None and not changes.is_clean(kind, key, entry, index):
+                    continue
+                replay[(kind, key)] = entry
+        return replay
@@ -0,0 +1,69 @@
+# Copyright (C) 2012  Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Author(s):    Martin Gracik <mgracik@redhat.com>
+#
+
+import fnmatch
+import os
+
+from alda import Package, is_glob
+
+
+INCLUDE = '%include'
+
+
+def parse_line(line, arches):
+    name, _sep, arch = line.rpartition('.')
+    if not name or (arch not in arches and not (is_glob(arch) and fnmatch.filter(arches, arch))):
+        return Package(name=line, arch=None)
+    return Package(name=name, arch=arch)
+
+
+# Every line holds a name or name.arch, either of which can be a glob. Lines starting
+# with - are excludes and '%include FILENAME' reads another list relative to this one.
+def parse_packages(lines, arches, filename=None, _including=()):
+    arches = set(arches)
+    packages = set()
+    excludes = set()
+    for line in lines:
+        line, _sep, _comment = line.partition('#')
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith(INCLUDE):
+            if filename is None:
+                raise ValueError('%s: only package list files can include other lists' % line)
+            path = os.path.join(os.path.dirname(filename), line[len(INCLUDE):].strip())
+            more_packages, more_excludes = read_packages(path, arches, _including)
+            packages |= more_packages
+            excludes |= more_excludes
+        elif line.startswith('-'):
+            excludes.add(parse_line(line[1:], arches))
+        else:
+            packages.add(parse_line(line, arches))
+
+    return packages, excludes
+
+
+def read_packages(filename, arches, _including=()):
+    filename = os.path.abspath(filename)
+    if filename in _including:
+        raise ValueError("'%s' includes itself" % filename)
+
+    with open(filename, 'r') as fileobj:
+        return parse_packages(fileobj, arches, filename, _including + (filename,))
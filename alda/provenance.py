@@ -0,0 +1,107 @@
+# Copyright (C) 2012  Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Author(s):    Martin Gracik <mgracik@redhat.com>
+#
+
+import json
+
+
+def split_key(key):
+    # repo id/NEVRA -> repo id, NEVRA, name
+    reponame, _sep, nevra = key.partition('/')
+    return reponame, nevra, nevra.rsplit('-', 2)[0]
+
+
+class Provenance(dict):
+
+    '''
+    Why every package of a run was added.
+
+    Maps the repo id/NEVRA key of a package to the reason it was added and
+    what caused it - the request for dependencies of a request, otherwise
+    the key of the package it was added for. Requests solved together in a
+    batch are recorded joined with commas.
+
+    '''
+
+    VERSION = 1
+
+    def __init__(self, *args, **kwargs):
+        super(Provenance, self).__init__(*args, **kwargs)
+        self.setdefault('version', self.VERSION)
+        self.setdefault('packages', {})
+        self._children = None
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r') as fileobj:
+            provenance = cls(json.load(fileobj))
+        if provenance.get('version') != cls.VERSION:
+            raise ValueError("Unsupported provenance version in '%s'" % filename)
+        return provenance
+
+    def save(self, filename):
+        with open(filename, 'w') as fileobj:
+            json.dump(self, fileobj, sort_keys=True)
+
+    @property
+    def packages(self):
+        return self['packages']
+
+    def add(self, key, reason, cause):
+        # Only the first cause is kept - a package is added once.
+        if key not in self.packages:
+            self.packages[key] = (reason, cause)
+            self._children = None
+
+    def find(self, package):
+        # Keys of the packages with the given name, NEVRA or key.
+        return sorted(key for key in self.packages if package in (key,) + split_key(key)[1:])
+
+    def why(self, key):
+        # The chain of (key, reason) from the package up to the request that added it.
+        chain = []
+        seen = set()
+        while key in self.packages and key not in seen:
+            seen.add(key)
+            reason, cause = self.packages[key]
+            chain.append((key, reason))
+            key = cause
+        chain.append((key, 'request'))
+        return chain
+
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = {}
+            for key, (_reason, cause) in self.packages.items():
+                self._children.setdefault(cause, []).append(key)
+        return self._children
+
+    def get_requests(self):
+        return sorted(set(cause for _reason, cause in self.packages.values()) - set(self.packages))
+
+    def pulls(self, request):
+        # Everything added because of the request, directly or through srpms, builddeps and subpackages.
+        causes = [cause for cause in self.get_requests() if request in cause.split(',')]
+        result = set()
+        while causes:
+            for key in self.children.get(causes.pop(), []):
+                if key not in result:
+                    result.add(key)
+                    causes.append(key)
+        return sorted(result)
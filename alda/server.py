@@ -0,0 +1,185 @@
+# Copyright (C) 2012  Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Author(s):    Martin Gracik <mgracik@redhat.com>
+#
+
+import errno
+import json
+import logging
+import os
+import shutil
+import socket
+import SocketServer
+import threading
+
+from alda import ALDA
+from packagelist import parse_packages
+
+
+def is_count(value, minimum=0):
+    # Only JSON numbers - on Python 2 a string compares greater than any int.
+    return isinstance(value, (int, long)) and not isinstance(value, bool) and value >= minimum
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            if not isinstance(request, dict):
+                raise ValueError('A request must be a JSON object')
+            response = self.server.resolver.resolve(request.get('packages', []),
+                                                    options=request.get('options'),
+                                                    batch_size=request.get('batch_size', 1))
+        except (ValueError, TypeError) as e:
+            response = dict(error=str(e))
+        except Exception as e:
+            # Every request gets an answer, the traceback stays in the log of the server.
+            logging.getLogger('alda.Server').exception('resolving a request failed')
+            response = dict(error='%s: %s' % (type(e).__name__, e))
+        self.wfile.write('%s\n' % json.dumps(response, sort_keys=True))
+
+
+class Resolver(object):
+
+    '''
+    Resolves requests against a sack that stays loaded between them.
+
+    Every request gets its own ALDA sharing the sack, so requests never see
+    each other's packages or excludes, and builddeps closures are shared by
+    the requests with the same options. A thread checks the repositories'
+    repomd.xml every interval seconds and swaps in a newly loaded sack when
+    any of them changed.
+
+    '''
+
+    def __init__(self, repodict, arch=None, cache=None, jobs=1, interval=300):
+        self.log = logging.getLogger('alda.Resolver')
+        self.repodict = repodict
+        self.arch = arch
+        self.cache = cache
+        self.jobs = jobs
+        self.interval = interval
+        self.current = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self):
+        alda_ = ALDA(self.repodict, cache=self.cache)
+        alda_.load_sack(arch=self.arch, jobs=self.jobs)
+        alda_.cleanup()
+        with self._lock:
+            self.current = alda_
+        self.log.info('loaded repositories, fingerprint %s', alda_.fingerprint)
+
+    def get_fingerprint(self):
+        metadata = []
+        try:
+            for name, path in self.repodict.items():
+                repoinfo, metadir = ALDA.get_repo_metadata(name, path, yumdlist=())
+                metadata.append((name, repoinfo, metadir))
+            return ALDA.get_fingerprint(self.arch, metadata)
+        finally:
+            for _name, _repoinfo, metadir in metadata:
+                if metadir:
+                    shutil.rmtree(metadir)
+
+    def check(self):
+        try:
+            if self.get_fingerprint() != self.current.fingerprint:
+                self.log.info('repositories changed, reloading')
+                self.load()
+        except Exception:
+            # A repository being updated right now is checked again next time.
+            self.log.exception('checking the repositories failed')
+
+    def start(self):
+        self.load()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def resolve(self, lines, options=None, batch_size=1):
+        with self._lock:
+            current = self.current
+
+        options = options or {}
+        if not isinstance(options, dict):
+            raise ValueError('Options must be a JSON object')
+        if set(options) - set(ALDA.DEFAULT_OPTIONS):
+            raise ValueError('Unknown options: %s' % ', '.join(sorted(set(options) - set(ALDA.DEFAULT_OPTIONS))))
+        for name, value in sorted(options.items()):
+            # Flags take booleans, the limits a count or null.
+            if isinstance(ALDA.DEFAULT_OPTIONS[name], bool):
+                valid = isinstance(value, bool)
+            else:
+                valid = value is None or is_count(value)
+            if not valid:
+                raise ValueError('Invalid value of option %s: %s' % (name, json.dumps(value)))
+        if not is_count(batch_size, minimum=1):
+            raise ValueError('Invalid batch size: %s' % json.dumps(batch_size))
+        alda_ = current.new_resolution(options)
+        packages, excludes = parse_packages(lines, alda_.arches)
+        alda_.resolve_dependencies(packages, excludes, batch_size=batch_size)
+        return dict(fingerprint=alda_.fingerprint,
+                    urls=sorted(alda_.urls),
+                    installs=sorted((str(hpo), hpo.reponame) for hpo in alda_.installs),
+                    problems=sorted(map(str, alda_.problems)),
+                    missing=sorted(map(str, alda_.missing)))
+
+
+class Server(SocketServer.UnixStreamServer):
+
+    '''Serves a Resolver on a Unix socket, one request at a time.'''
+
+    def __init__(self, path, resolver):
+        self.resolver = resolver
+        try:
+            os.unlink(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        SocketServer.UnixStreamServer.__init__(self, path, RequestHandler)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        os.unlink(self.server_address)
+
+
+def request(path, lines, options=None, batch_size=1):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        fileobj = sock.makefile('rw')
+        fileobj.write('%s\n' % json.dumps(dict(packages=list(lines), options=options or {}, batch_size=batch_size)))
+        fileobj.flush()
+        response = json.loads(fileobj.readline())
+    finally:
+        sock.close()
+    if 'error' in response:
+        raise ValueError(response['error'])
+    return response
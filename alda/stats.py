@@ -0,0 +1,77 @@
+# Copyright (C) 2012  Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Author(s):    Martin Gracik <mgracik@redhat.com>
+#
+
+from contextlib import contextmanager
+import json
+import time
+
+
+class Stats(dict):
+
+    '''
+    Counters and timers of a run.
+
+    Counters count events, e.g. queries or solved goals, timers sum up the
+    seconds spent in a phase together with how many times it was entered.
+
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(Stats, self).__init__(*args, **kwargs)
+        self.setdefault('counters', {})
+        self.setdefault('timers', {})
+
+    @property
+    def counters(self):
+        return self['counters']
+
+    @property
+    def timers(self):
+        return self['timers']
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name, seconds):
+        timer = self.timers.setdefault(name, dict(calls=0, seconds=0.0))
+        timer['calls'] += 1
+        timer['seconds'] += seconds
+
+    def merge(self, other):
+        # Adds the counters and timers of another run, e.g. of a worker process.
+        for name, n in other.counters.items():
+            self.count(name, n)
+        for name, timer in other.timers.items():
+            mine = self.timers.setdefault(name, dict(calls=0, seconds=0.0))
+            mine['calls'] += timer['calls']
+            mine['seconds'] += timer['seconds']
+        if 'max_queue_depth' in other:
+            self['max_queue_depth'] = max(self.get('max_queue_depth', 0), other['max_queue_depth'])
+
+    @contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def save(self, filename):
+        with open(filename, 'w') as fileobj:
+            json.dump(self, fileobj, indent=2, sort_keys=True)
@@ -17,7 +17,15 @@
 # Author(s):    Martin Gracik <mgracik@redhat.com>
 #
 
+import json
 import os
+import shutil
+import SimpleHTTPServer
+import SocketServer
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 
 import alda
@@ -38,6 +46,32 @@ class ALDATestCase(unittest.TestCase):
         return alda_
 
 
+class RepoRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+
+    def translate_path(self, path):
+        path = SimpleHTTPServer.SimpleHTTPRequestHandler.translate_path(self, path)
+        return os.path.join(self.server.repodir, os.path.relpath(path, os.getcwd()))
+
+    def log_message(self, *args):
+        pass
+
+
+class HTTPRepoTestCase(ALDATestCase):
+
+    def setUp(self):
+        self.server = SocketServer.TCPServer(('127.0.0.1', 0), RepoRequestHandler)
+        self.server.repodir = self.repodir
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.repourl = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
 class TestDefault(ALDATestCase):
 
     '''
@@ -128,5 +162,751 @@ class TestNoDebuginfo(ALDATestCase):
                          sorted(self.alda.installs_as_strings))
 
 
+class TestFullTree(ALDATestCase):
+
+    def setUp(self):
+        self.alda = self.get_alda(options=dict(fulltree=True), arch='x86_64')
+
+    def test_bash(self):
+        self.alda.resolve_dependencies(BASH)
+        self.assertTrue(set(['dummy-bash-4.2.24-2.src', 'dummy-bash-4.2.24-2.x86_64',
+                             'dummy-bash-debuginfo-4.2.24-2.x86_64', 'dummy-bash-doc-4.2.24-2.x86_64'])
+                        <= set(self.alda.installs_as_strings))
+        self.assertEqual(0, self.alda._installs.queue_depth)
+
+
+class TestExcludes(ALDATestCase):
+
+    def setUp(self):
+        self.alda = self.get_alda(arch='x86_64')
+
+    def test_exclude(self):
+        self.alda.resolve_dependencies(BASESYSTEM | BASH, set([alda.Package(name='dummy-setup', arch=None)]))
+        self.assertEqual(['dummy-bash-4.2.24-2.src', 'dummy-bash-4.2.24-2.x86_64',
+                          'dummy-bash-debuginfo-4.2.24-2.x86_64'],
+                         sorted(self.alda.installs_as_strings))
+
+    def test_exclude_arch(self):
+        self.alda.resolve_dependencies(BASESYSTEM | BASH, set([alda.Package(name='dummy-setup', arch='x86_64')]))
+        self.assertIn('dummy-setup-2.8.48-1.noarch', self.alda.installs_as_strings)
+
+    def test_exclude_glob(self):
+        self.alda.resolve_dependencies(BASESYSTEM | BASH, set([alda.Package(name='*-filesystem', arch='x86*')]))
+        self.assertEqual(['dummy-bash-4.2.24-2.src', 'dummy-bash-4.2.24-2.x86_64',
+                          'dummy-bash-debuginfo-4.2.24-2.x86_64'],
+                         sorted(self.alda.installs_as_strings))
+
+
+class GreedyGoal(object):
+
+    def __init__(self, solutions):
+        self.solutions = solutions
+        self.problems = []
+        self.installs = []
+
+    def run(self):
+        self.installs = self.solutions[0]
+        return True
+
+    def run_all(self, callback):
+        for installs in self.solutions:
+            self.installs = installs
+            callback(self)
+
+    def list_installs(self):
+        return list(self.installs)
+
+
+class TestGreedyLimits(ALDATestCase):
+
+    def get_accumulator(self, **options):
+        options.update(greedy=True)
+        accumulator = alda.alda.Accumulator(options)
+        accumulator.set_sack(self.get_alda(arch='x86_64').sack)
+        return accumulator
+
+    def solve(self, accumulator, solutions):
+        solved = []
+        accumulator.solve(GreedyGoal(solutions), lambda goal: solved.append(goal.list_installs()))
+        return solved
+
+    def test_duplicates(self):
+        accumulator = self.get_accumulator()
+        a, b, c = accumulator.index.packages[:3]
+        self.assertEqual([[a, b], [a, c]], self.solve(accumulator, [[a, b], [b, a], [a, c], [a, b]]))
+        self.assertEqual(4, accumulator.stats.counters['greedy_enumerated'])
+        self.assertEqual(2, accumulator.stats.counters['greedy_duplicates'])
+
+    def test_limits(self):
+        accumulator = self.get_accumulator(max_solutions=2, max_greedy_solutions=3)
+        a, b, c = accumulator.index.packages[:3]
+        self.assertEqual([[a], [b]], self.solve(accumulator, [[a], [b], [c]]))
+        self.assertEqual(1, accumulator.stats.counters['greedy_truncated'])
+        self.assertEqual([[c]], self.solve(accumulator, [[c], [a]]))
+        # The budget is used up, the next goal is solved for a single solution.
+        self.assertEqual([[b]], self.solve(accumulator, [[b], [c]]))
+        self.assertEqual(3, accumulator.greedy_solutions)
+
+
+class TestMissing(ALDATestCase):
+
+    def test_missing(self):
+        missing = set([alda.Package(name='dummy-nosuchpackage', arch=None),
+                       alda.Package(name='dummy-bash', arch='ppc64')])
+        alda_ = self.get_alda(arch='x86_64')
+        alda_.resolve_dependencies(BASH | missing)
+        self.assertEqual(sorted(missing), sorted(alda_.missing))
+        self.assertEqual(['dummy-bash-4.2.24-2.src', 'dummy-bash-4.2.24-2.x86_64',
+                          'dummy-bash-debuginfo-4.2.24-2.x86_64'], sorted(alda_.installs_as_strings))
+
+
+class TestPackageList(ALDATestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='alda-list.')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, lines):
+        with open(os.path.join(self.tmpdir, name), 'w') as fileobj:
+            fileobj.write('\n'.join(lines))
+
+    def test_read(self):
+        self.write('base', ['dummy-basesystem  # comment', '-dummy-setup*'])
+        self.write('list', ['%include base', 'dummy-bash*.x86_64', 'python3-*', '-*-doc.i686'])
+        packages, excludes = alda.read_packages(os.path.join(self.tmpdir, 'list'), ['i686', 'x86_64'])
+        self.assertEqual(set([alda.Package('dummy-basesystem', None), alda.Package('dummy-bash*', 'x86_64'),
+                              alda.Package('python3-*', None)]), packages)
+        self.assertEqual(set([alda.Package('dummy-setup*', None), alda.Package('*-doc', 'i686')]), excludes)
+
+        self.write('base', ['%include list'])
+        self.assertRaises(ValueError, alda.read_packages, os.path.join(self.tmpdir, 'list'), ['x86_64'])
+
+    def test_glob(self):
+        alda_ = self.get_alda(arch='x86_64')
+        alda_.resolve_dependencies(set([alda.Package('dummy-bash*', 'x86_64'), alda.Package('python3-*', None)]))
+        self.assertEqual(['python3-*'], map(str, alda_.missing))
+        self.assertEqual(['dummy-bash-4.2.24-2.src', 'dummy-bash-4.2.24-2.x86_64',
+                          'dummy-bash-debuginfo-4.2.24-2.x86_64', 'dummy-bash-doc-4.2.24-2.x86_64'],
+                         sorted(alda_.installs_as_strings))
+
+    def test_glob_source_only(self):
+        # A source package whose binary packages are all named differently.
+        index = self.get_alda(arch='x86_64')._installs.index
+        index.names['dummy-tools'] = set(['src'])
+        self.assertEqual(set(), index.expand(alda.Package('dummy-tool*', None)))
+        self.assertEqual(set([alda.Package('dummy-tools', 'src')]), index.expand(alda.Package('dummy-tool*', 's*')))
+        self.assertFalse(index.has_package('dummy-tools'))
+        self.assertTrue(index.has_package('dummy-tools', 'src'))
+
+
+class TestLazyFilelists(ALDATestCase):
+
+    def test_lazy(self):
+        options = dict(selfhosting=True, fulltree=True)
+        eager = self.get_alda(options=options, arch='x86_64')
+        eager.resolve_dependencies(BASESYSTEM | BASH)
+
+        lazy = alda.ALDA(self.repodict, options)
+        lazy.load_sack(arch='x86_64', lazy_filelists=True)
+        lazy.resolve_dependencies(BASESYSTEM | BASH)
+        self.assertEqual(sorted(eager.installs_as_strings), sorted(lazy.installs_as_strings))
+        self.assertEqual(sorted(eager.problems), sorted(lazy.problems))
+
+    def test_older_candidate(self):
+        # dummy-viewer-2.0 requires a file listed only in filelists.xml, without it the
+        # solver picks dummy-viewer-1.0 and reports no problems.
+        viewer = set([alda.Package(name='dummy-viewer', arch=None)])
+        eager = self.get_alda(arch='x86_64')
+        eager.resolve_dependencies(viewer)
+        self.assertIn('dummy-viewer-2.0-1.noarch', eager.installs_as_strings)
+
+        lazy = alda.ALDA(self.repodict)
+        lazy.load_sack(arch='x86_64', lazy_filelists=True)
+        lazy.resolve_dependencies(viewer)
+        self.assertFalse(lazy.lazy_filelists)
+        self.assertEqual(sorted(eager.installs_as_strings), sorted(lazy.installs_as_strings))
+
+
+class TestBatch(ALDATestCase):
+
+    def test_batch(self):
+        serial = self.get_alda(arch='x86_64')
+        serial.resolve_dependencies(BASESYSTEM | BASH)
+        batched = self.get_alda(arch='x86_64')
+        batched.resolve_dependencies(BASESYSTEM | BASH, batch_size=2)
+        self.assertEqual(sorted(serial.installs_as_strings), sorted(batched.installs_as_strings))
+        # A batch is not the solution of its requests, it is never replayed for one of them.
+        self.assertEqual({}, batched.manifest['solutions'].get('request', {}))
+
+        previous = self.get_alda(arch='x86_64')
+        previous.set_previous(batched.manifest)
+        previous.resolve_dependencies(BASH)
+        self.assertEqual(['dummy-bash-4.2.24-2.src', 'dummy-bash-4.2.24-2.x86_64',
+                          'dummy-bash-debuginfo-4.2.24-2.x86_64'],
+                         sorted(previous.installs_as_strings))
+
+    def test_batch_split(self):
+        excludes = set([alda.Package(name='dummy-setup', arch=None)])
+        serial = self.get_alda(arch='x86_64')
+        serial.resolve_dependencies(BASESYSTEM | BASH, excludes)
+        batched = self.get_alda(arch='x86_64')
+        batched.resolve_dependencies(BASESYSTEM | BASH, excludes, batch_size=2)
+        self.assertEqual(['dummy-bash-4.2.24-2.src', 'dummy-bash-4.2.24-2.x86_64',
+                          'dummy-bash-debuginfo-4.2.24-2.x86_64'],
+                         sorted(batched.installs_as_strings))
+        self.assertEqual(sorted(serial.installs_as_strings), sorted(batched.installs_as_strings))
+        self.assertEqual(serial.problems, batched.problems)
+
+    def test_batch_providers(self):
+        # dummy-exim and dummy-postfix both provide dummy-mta, so a batch with dummy-postfix
+        # could satisfy the requirement of dummy-mailer differently than solving it alone.
+        packages = set([alda.Package(name='dummy-mailer', arch=None), alda.Package(name='dummy-postfix', arch=None)])
+        serial = self.get_alda(arch='x86_64')
+        serial.resolve_dependencies(packages)
+        batched = self.get_alda(arch='x86_64')
+        batched.resolve_dependencies(packages, batch_size=2)
+        self.assertEqual(sorted(serial.installs_as_strings), sorted(batched.installs_as_strings))
+        self.assertEqual(serial.problems, batched.problems)
+
+
+class TestManifest(ALDATestCase):
+
+    def test_previous(self):
+        first = self.get_alda(options=dict(selfhosting=True), arch='x86_64')
+        first.resolve_dependencies(BASESYSTEM | BASH)
+        manifest = first.manifest
+        self.assertEqual(sorted(first.installs_as_strings), sorted(nevra for nevra, _repo in manifest['installs']))
+
+        # Nothing changed, so every goal is replayed from the manifest.
+        second = self.get_alda(options=dict(selfhosting=True), arch='x86_64')
+        second.set_previous(manifest)
+        second.resolve_dependencies(BASESYSTEM | BASH)
+        self.assertEqual(sorted(first.installs_as_strings), sorted(second.installs_as_strings))
+        self.assertEqual(sum(len(entries) for entries in manifest['solutions'].values()),
+                         second._installs.replayed)
+
+
+class TestDiff(ALDATestCase):
+
+    def test_same_snapshot(self):
+        options = dict(selfhosting=True, fulltree=True)
+        diff = alda.Diff(self.repodict, self.repodict, options)
+        diff.load_sack(arch='x86_64')
+        diff.resolve_dependencies(BASESYSTEM | BASH)
+        self.assertEqual([], diff.get_changes())
+
+        expected = self.get_alda(options=options, arch='x86_64')
+        expected.resolve_dependencies(BASESYSTEM | BASH)
+        for side in ('old', 'new'):
+            alda_ = getattr(diff, side)
+            self.assertEqual(sorted(expected.installs_as_strings), sorted(alda_.installs_as_strings))
+            self.assertEqual(set(['%s:alda-repo' % side]), set(hpo.reponame for hpo in alda_.installs))
+        # Nothing changed, so every goal of the old side is replayed on the new one.
+        self.assertEqual(len(diff.old._installs.solutions), diff.new._installs.replayed)
+
+    def test_translate(self):
+        manifest = alda.Manifest(version=alda.Manifest.VERSION, fingerprint='f', arch='x86_64', greedy=False,
+                                 solutions=dict(
+                                     request={'dummy-bash': dict(solutions=[[('dummy-bash-4.2.24-2.x86_64',
+                                                                              'old:alda-repo')]], problems=[])},
+                                     builddeps={'old:alda-repo/dummy-setup-2.8.48-1.src': dict(solutions=[[]],
+                                                                                              problems=[])}))
+        translated = alda.Diff.translate(manifest)
+        self.assertEqual([[('dummy-bash-4.2.24-2.x86_64', 'new:alda-repo')]],
+                         translated['solutions']['request']['dummy-bash']['solutions'])
+        self.assertEqual(['new:alda-repo/dummy-setup-2.8.48-1.src'], list(translated['solutions']['builddeps']))
+        self.assertEqual('old:alda-repo', manifest['solutions']['request']['dummy-bash']['solutions'][0][0][1])
+
+
+class TestProvenance(ALDATestCase):
+
+    def test_provenance(self):
+        alda_ = self.get_alda(options=dict(selfhosting=True, fulltree=True), arch='x86_64')
+        alda_.resolve_dependencies(BASESYSTEM)
+        provenance = alda_.provenance
+        keys = sorted('alda-repo/%s' % nevra for nevra in alda_.installs_as_strings)
+        self.assertEqual(keys, sorted(provenance.packages))
+        self.assertEqual(['dummy-basesystem'], provenance.get_requests())
+        self.assertEqual(keys, provenance.pulls('dummy-basesystem'))
+        # dummy-setup needs dummy-bash to build.
+        key, = provenance.find('dummy-bash-4.2.24-2.x86_64')
+        self.assertEqual((key, 'builddep'), provenance.why(key)[0])
+
+        key, = provenance.find('dummy-setup-2.8.48-1.src')
+        self.assertEqual([(key, 'srpm'), ('alda-repo/dummy-setup-2.8.48-1.noarch', 'dependency'),
+                          ('dummy-basesystem', 'request')], provenance.why(key))
+        self.assertEqual(['alda-repo/dummy-bash-doc-4.2.24-2.i686', 'alda-repo/dummy-bash-doc-4.2.24-2.x86_64'],
+                         provenance.find('dummy-bash-doc'))
+
+        fd, filename = tempfile.mkstemp(prefix='alda-provenance.')
+        os.close(fd)
+        try:
+            provenance.save(filename)
+            loaded = alda.Provenance.load(filename)
+        finally:
+            os.unlink(filename)
+        self.assertEqual(provenance.why(key), [tuple(item) for item in loaded.why(key)])
+
+
+class Interrupted(Exception):
+    pass
+
+
+class TestCheckpoint(ALDATestCase):
+
+    def get_interrupted(self, filename, options):
+        alda_ = self.get_alda(options=options, arch='x86_64')
+
+        # Stops the run right after the first checkpoint is saved.
+        def checkpoint(force=False):
+            alda.ALDA.checkpoint(alda_, force)
+            if os.path.exists(filename):
+                raise Interrupted()
+        alda_.checkpoint = checkpoint
+        alda_.set_checkpoint(filename, interval=0)
+        self.assertRaises(Interrupted, alda_.resolve_dependencies, BASESYSTEM | BASH)
+        return alda_
+
+    def test_resume(self):
+        options = dict(selfhosting=True, fulltree=True)
+        expected = self.get_alda(options=options, arch='x86_64')
+        expected.resolve_dependencies(BASESYSTEM | BASH)
+
+        tmpdir = tempfile.mkdtemp(prefix='alda-checkpoint.')
+        filename = os.path.join(tmpdir, 'checkpoint')
+        try:
+            interrupted = self.get_interrupted(filename, options)
+            checkpoint = alda.Checkpoint.load(filename)
+            self.assertEqual(interrupted.fingerprint, checkpoint['key'])
+            self.assertTrue(len(checkpoint['state']['data']) < len(expected.installs))
+
+            resumed = self.get_alda(options=options, arch='x86_64')
+            resumed.set_checkpoint(filename)
+            resumed.resolve_dependencies(BASESYSTEM | BASH)
+            self.assertEqual(sorted(expected.installs_as_strings), sorted(resumed.installs_as_strings))
+            self.assertEqual(sorted(expected.provenance.packages), sorted(resumed.provenance.packages))
+            self.assertTrue(resumed.stats.counters['goals'] < expected.stats.counters['goals'])
+            self.assertFalse(os.path.exists(filename))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_other_run(self):
+        options = dict(selfhosting=True, fulltree=True)
+        tmpdir = tempfile.mkdtemp(prefix='alda-checkpoint.')
+        filename = os.path.join(tmpdir, 'checkpoint')
+        try:
+            self.get_interrupted(filename, options)
+            # Other options resolve everything again.
+            alda_ = self.get_alda(options=dict(selfhosting=True), arch='x86_64')
+            alda_.set_checkpoint(filename)
+            alda_.resolve_dependencies(BASESYSTEM | BASH)
+            expected = self.get_alda(options=dict(selfhosting=True), arch='x86_64')
+            expected.resolve_dependencies(BASESYSTEM | BASH)
+            self.assertEqual(sorted(expected.installs_as_strings), sorted(alda_.installs_as_strings))
+            self.assertEqual(expected.stats.counters['goals'], alda_.stats.counters['goals'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestSharding(ALDATestCase):
+
+    def test_parallel(self):
+        options = dict(selfhosting=True, fulltree=True)
+        serial = self.get_alda(options=options, arch='x86_64')
+        serial.resolve_dependencies(BASESYSTEM | BASH)
+
+        parallel = self.get_alda(options=options, arch='x86_64')
+        parallel.resolve_parallel(BASESYSTEM | BASH, processes=2)
+        self.assertEqual(sorted(serial.installs_as_strings), sorted(parallel.installs_as_strings))
+        self.assertEqual(serial.provenance.packages, parallel.provenance.packages)
+        self.assertEqual(serial.problems, parallel.problems)
+        self.assertEqual(serial._installs.skiplist, parallel._installs.skiplist)
+        # Every goal of the run was solved by the shards.
+        self.assertEqual(len(parallel._installs.solutions), parallel._installs.replayed)
+        self.assertTrue(parallel._installs.closures)
+
+    def test_batches(self):
+        serial = self.get_alda(arch='x86_64')
+        serial.resolve_dependencies(BASESYSTEM | BASH, batch_size=2)
+        parallel = self.get_alda(arch='x86_64')
+        parallel.resolve_parallel(BASESYSTEM | BASH, batch_size=2, processes=2)
+        self.assertEqual(sorted(serial.installs_as_strings), sorted(parallel.installs_as_strings))
+        self.assertEqual(serial.provenance.packages, parallel.provenance.packages)
+
+    def test_serial(self):
+        alda_ = self.get_alda(options=dict(greedy=True, max_greedy_solutions=1), arch='x86_64')
+        alda_.resolve_parallel(BASESYSTEM | BASH, processes=2)
+        self.assertEqual(0, alda_._installs.replayed)
+        self.assertTrue(alda_.installs)
+
+
+class TestResolveMany(ALDATestCase):
+
+    RESOLUTIONS = [dict(packages=BASESYSTEM, options=dict(selfhosting=True)),
+                   dict(packages=BASH),
+                   dict(packages=BASH, options=dict(fulltree=True)),
+                   dict(packages=BASESYSTEM | BASH, options=dict(selfhosting=True, fulltree=True)),
+                   dict(packages=BASESYSTEM | BASH, excludes=set([alda.Package(name='dummy-setup', arch=None)])),
+                   dict(packages=BASESYSTEM | BASH, options=dict(source=False), batch_size=2)]
+
+    def test_resolve_many(self):
+        shared = self.get_alda(arch='x86_64')
+        results = shared.resolve_many(self.RESOLUTIONS * 2, jobs=4)
+        self.assertEqual([], shared.installs)
+
+        for resolution, result in zip(self.RESOLUTIONS * 2, results):
+            resolution = dict(resolution)
+            isolated = self.get_alda(options=resolution.pop('options', None), arch='x86_64')
+            isolated.resolve_dependencies(**resolution)
+            self.assertTrue(result.sack is shared.sack)
+            self.assertEqual(sorted(isolated.installs_as_strings), sorted(result.installs_as_strings))
+            self.assertEqual(sorted(map(str, isolated.problems)), sorted(map(str, result.problems)))
+            self.assertEqual(isolated.provenance.packages, result.provenance.packages)
+
+    def test_reuse(self):
+        shared = self.get_alda(arch='x86_64')
+        first = shared.new_resolution(dict(selfhosting=True))
+        first.resolve_dependencies(BASESYSTEM)
+        second = shared.new_resolution(dict(selfhosting=True))
+        second.resolve_dependencies(BASESYSTEM)
+        self.assertEqual(sorted(first.installs_as_strings), sorted(second.installs_as_strings))
+        # The builddeps solved for the first resolution are replayed for the second.
+        self.assertTrue(first._installs.closures is second._installs.closures)
+        self.assertEqual(0, first._installs.replayed)
+        self.assertTrue(second._installs.replayed > 0)
+
+    def test_lazy_filelists(self):
+        # Every resolution needing the filelists would load a sack of its own.
+        lazy = alda.ALDA(self.repodict)
+        lazy.load_sack(arch='x86_64', lazy_filelists=True)
+        self.assertRaises(ValueError, lazy.new_resolution)
+        self.assertRaises(ValueError, lazy.resolve_many, self.RESOLUTIONS)
+
+
+class TestStats(ALDATestCase):
+
+    def test_stats(self):
+        alda_ = self.get_alda(options=dict(selfhosting=True), arch='x86_64')
+        alda_.resolve_dependencies(BASESYSTEM | BASH)
+        counters = alda_.stats.counters
+        self.assertEqual(1, counters['repos_loaded'])
+        self.assertEqual(counters['goals'], len(alda_._installs.solutions))
+        self.assertTrue(counters['solutions'] >= counters['goals'])
+        self.assertTrue(counters['srpm_lookups'] > 0)
+        self.assertEqual(0, counters['bytes_downloaded'])
+        for name in ('download', 'load_sack', 'solve', 'process', 'resolve'):
+            self.assertTrue(alda_.stats.timers[name]['calls'] > 0)
+        # Processing a solution is not timed as solving it.
+        self.assertEqual(counters['goals'], alda_.stats.timers['solve']['calls'])
+
+
+class TestPackageSet(ALDATestCase):
+
+    def test_package_set(self):
+        index = self.get_alda(arch='x86_64')._installs.index
+        # The last package is dropped from the index, like a package of another sack.
+        missing = index.packages.pop()
+        del index.ids[missing]
+        first, second, third = index.packages[:3]
+
+        packages = alda.alda.PackageSet(index)
+        packages.add(second)
+        packages.add(first)
+        packages.add(second)
+        self.assertEqual(2, len(packages))
+        self.assertTrue(first in packages)
+        self.assertFalse(third in packages)
+        self.assertFalse(missing in packages)
+        self.assertEqual([first, second], list(packages))
+        self.assertEqual([third, missing], packages.difference([second, third, missing, first]))
+        self.assertRaises(KeyError, packages.add, missing)
+
+
+class TestAddedCallback(ALDATestCase):
+
+    def test_reasons(self):
+        added = []
+        alda_ = self.get_alda(options=dict(fulltree=True), arch='x86_64')
+        alda_.set_added_cb(lambda hpo, reason: added.append((str(hpo), reason)))
+        alda_.resolve_dependencies(BASH)
+        self.assertEqual(sorted(alda_.installs_as_strings), sorted(nevra for nevra, _reason in added))
+        reasons = dict(added)
+        self.assertEqual('dependency', reasons['dummy-bash-4.2.24-2.x86_64'])
+        self.assertEqual('srpm', reasons['dummy-bash-4.2.24-2.src'])
+        self.assertEqual('debuginfo', reasons['dummy-bash-debuginfo-4.2.24-2.x86_64'])
+        self.assertEqual('subpackage', reasons['dummy-bash-doc-4.2.24-2.x86_64'])
+
+
+class TestServer(ALDATestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='alda-server.')
+        self.repocopy = os.path.join(self.tmpdir, 'repo')
+        shutil.copytree(self.repodir, self.repocopy, symlinks=True)
+        self.resolver = alda.Resolver({'alda-repo': self.repocopy}, arch='x86_64')
+        self.resolver.load()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_request(self):
+        path = os.path.join(self.tmpdir, 'socket')
+        server = alda.Server(path, self.resolver)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            first = alda.request(path, ['dummy-bash', '-dummy-bash-doc'], dict(fulltree=True))
+            second = alda.request(path, ['dummy-bash'])
+            self.assertRaises(ValueError, alda.request, path, ['dummy-bash'], dict(nosuchoption=True))
+            self.assertRaises(ValueError, alda.request, path, ['dummy-bash'], dict(fulltree='yes'))
+            self.assertRaises(ValueError, alda.request, path, ['dummy-bash'], dict(max_solutions='5'))
+            self.assertRaises(ValueError, alda.request, path, ['dummy-bash'], batch_size='5')
+            self.assertRaises(ValueError, alda.request, path, ['dummy-bash'], batch_size=0)
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+
+        self.assertEqual([], first['problems'])
+        self.assertEqual(['dummy-bash-4.2.24-2.src', 'dummy-bash-4.2.24-2.x86_64',
+                          'dummy-bash-debuginfo-4.2.24-2.x86_64'], [nevra for nevra, _repo in second['installs']])
+        self.assertFalse(os.path.exists(path))
+
+    def test_failure(self):
+        # An unexpected error is answered too, instead of closing the connection.
+        def resolve(lines, options=None, batch_size=1):
+            raise AssertionError('broken')
+        self.resolver.resolve = resolve
+
+        path = os.path.join(self.tmpdir, 'socket')
+        server = alda.Server(path, self.resolver)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            with self.assertRaisesRegexp(ValueError, 'AssertionError: broken'):
+                alda.request(path, ['dummy-bash'])
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+
+    def test_reload(self):
+        loaded = self.resolver.current
+        self.resolver.check()
+        self.assertTrue(self.resolver.current is loaded)
+
+        with open(os.path.join(self.repocopy, 'repodata', 'repomd.xml'), 'a') as fileobj:
+            fileobj.write('\n')
+        self.resolver.check()
+        self.assertFalse(self.resolver.current is loaded)
+        self.assertNotEqual(loaded.fingerprint, self.resolver.current.fingerprint)
+
+
+class TestCommandLine(ALDATestCase):
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'bin', 'alda')
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='alda-cli.')
+        self.packages = os.path.join(self.tmpdir, 'packages')
+        with open(self.packages, 'w') as fileobj:
+            fileobj.write('dummy-basesystem\ndummy-bash\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_alda(self, *args):
+        env = dict(os.environ)
+        topdir = os.path.dirname(os.path.dirname(self.script))
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [topdir, env.get('PYTHONPATH')]))
+        process = subprocess.Popen([sys.executable, self.script, self.packages, '-r', self.repodir] + list(args),
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        stdout, stderr = process.communicate()
+        self.assertEqual(0, process.returncode, stderr)
+        return stdout.splitlines()
+
+    def test_arches(self):
+        manifest = os.path.join(self.tmpdir, 'manifest')
+        checkpoint = os.path.join(self.tmpdir, 'checkpoint')
+        arches = ['--arch', 'x86_64', '--arch', 'i686']
+        lines = self.run_alda(*arches + ['--manifest', manifest, '--checkpoint', checkpoint])
+
+        # Every URL is tagged with its arch and the same as a run for that arch alone gives.
+        urls = {}
+        for line in lines:
+            arch, url = line.split('\t')
+            urls.setdefault(arch, []).append(url)
+        self.assertEqual(['i686', 'x86_64'], sorted(urls))
+        for arch in ('i686', 'x86_64'):
+            self.assertEqual(self.run_alda('--arch', arch), urls[arch])
+            self.assertTrue(os.path.exists('%s.%s' % (manifest, arch)))
+            self.assertFalse(os.path.exists('%s.%s' % (checkpoint, arch)))
+
+        # Every arch reuses the manifest saved for it.
+        self.assertEqual(lines, self.run_alda(*arches + ['--previous', manifest]))
+
+        records = [json.loads(line) for line in self.run_alda(*arches + ['--format', 'ndjson'])]
+        for arch in ('i686', 'x86_64'):
+            self.assertEqual(sorted(urls[arch]), sorted(record['url'] for record in records
+                                                        if record['type'] == 'package' and record['target'] == arch))
+            self.assertEqual(1, len([record for record in records
+                                     if record['type'] == 'summary' and record['target'] == arch]))
+
+
+class TestHTTPDownload(HTTPRepoTestCase):
+
+    def test_parallel_download(self):
+        repodict = {'alda-repo': self.repourl, 'alda-repo-local': self.repodir}
+        alda_ = alda.ALDA(repodict)
+        alda_.load_sack(arch='x86_64', jobs=2)
+        metadir, = alda_.metadirs
+        self.assertTrue(os.path.isdir(metadir))
+
+        alda_.resolve_dependencies(BASH)
+        self.assertEqual(['dummy-bash-4.2.24-2.src', 'dummy-bash-4.2.24-2.x86_64',
+                          'dummy-bash-debuginfo-4.2.24-2.x86_64'],
+                         sorted(set(alda_.installs_as_strings)))
+        # The metadata stays until cleanup(), resolving does not remove it.
+        self.assertTrue(os.path.exists(metadir))
+        alda_.cleanup()
+        self.assertFalse(os.path.exists(metadir))
+        self.assertTrue(alda_.stats.counters['bytes_downloaded'] > 0)
+
+
+class TestMetadataCache(HTTPRepoTestCase):
+
+    def setUp(self):
+        super(TestMetadataCache, self).setUp()
+        self.cachedir = tempfile.mkdtemp(prefix='alda-cache.')
+
+    def tearDown(self):
+        super(TestMetadataCache, self).tearDown()
+        shutil.rmtree(self.cachedir)
+
+    def get_cached_alda(self, cache):
+        alda_ = alda.ALDA({'alda-repo': self.repourl}, cache=cache)
+        alda_.load_sack(arch='x86_64')
+        return alda_
+
+    def test_reuse(self):
+        cache = alda.MetadataCache(self.cachedir)
+        self.get_cached_alda(cache)
+        (_mtime, _size, entry), = cache.get_entries()
+        repodata = os.path.join(entry, 'repodata')
+        mtimes = [os.stat(os.path.join(repodata, fn)).st_mtime for fn in sorted(os.listdir(repodata))]
+
+        alda_ = self.get_cached_alda(cache)
+        self.assertEqual([entry], [e for _mtime, _size, e in cache.get_entries()])
+        self.assertEqual(mtimes,
+                         [os.stat(os.path.join(repodata, fn)).st_mtime for fn in sorted(os.listdir(repodata))])
+        self.assertEqual([], alda_.metadirs)
+
+        alda_.resolve_dependencies(BASH)
+        self.assertEqual(['dummy-bash-4.2.24-2.src', 'dummy-bash-4.2.24-2.x86_64',
+                          'dummy-bash-debuginfo-4.2.24-2.x86_64'],
+                         sorted(alda_.installs_as_strings))
+
+    def test_builddeps_closures(self):
+        cache = alda.MetadataCache(self.cachedir)
+        alda_ = alda.ALDA(self.repodict, dict(selfhosting=True), cache)
+        alda_.load_sack(arch='x86_64')
+        alda_.resolve_dependencies(BASESYSTEM)
+        self.assertIn('dummy-bash-4.2.24-2.x86_64', alda_.installs_as_strings)
+
+        closures = cache.get_closures(alda_.closures_key)
+        key = 'alda-repo/dummy-setup-2.8.48-1.src'
+        self.assertIn(key, closures)
+
+        # A cached closure is used instead of solving the builddeps again.
+        closures[key] = dict(solutions=[[]], problems=[])
+        closures.save()
+        alda_ = alda.ALDA(self.repodict, dict(selfhosting=True), cache)
+        alda_.load_sack(arch='x86_64')
+        alda_.resolve_dependencies(BASESYSTEM)
+        self.assertNotIn('dummy-bash-4.2.24-2.x86_64', alda_.installs_as_strings)
+
+    def test_lazy_filelists(self):
+        cache = alda.MetadataCache(self.cachedir)
+        alda_ = alda.ALDA({'alda-repo': self.repourl}, cache=cache)
+        alda_.load_sack(arch='x86_64', lazy_filelists=True)
+        (_mtime, _size, entry), = cache.get_entries()
+        self.assertEqual(set(['primary']), cache.get_yumdlist(entry))
+        self.assertFalse([fn for fn in os.listdir(os.path.join(entry, 'repodata')) if 'filelists' in fn])
+
+        # The filelists are added to the same entry once they are needed.
+        alda_.resolve_dependencies(set([alda.Package(name='dummy-viewer', arch=None)]))
+        self.assertEqual(1, alda_.stats.counters['filelists_loads'])
+        self.assertIn('dummy-viewer-2.0-1.noarch', alda_.installs_as_strings)
+        self.assertEqual([entry], [e for _mtime, _size, e in cache.get_entries()])
+        self.assertEqual(set(['primary', 'filelists']), cache.get_yumdlist(entry))
+
+    def test_new_resolution(self):
+        cache = alda.MetadataCache(self.cachedir)
+        shared = self.get_cached_alda(cache)
+        alda_ = shared.new_resolution(dict(selfhosting=True))
+        self.assertTrue(alda_.cache is cache)
+        self.assertTrue(alda_._installs.closures is shared.get_closures(alda_.closures_key))
+
+    def test_evict(self):
+        self.get_cached_alda(alda.MetadataCache(self.cachedir))
+        cache = alda.MetadataCache(self.cachedir, max_size=0)
+        self.assertEqual(1, len(cache.get_entries()))
+        cache.clean()
+        self.assertEqual([], cache.get_entries())
+
+
+class TestFetch(HTTPRepoTestCase):
+
+    def setUp(self):
+        super(TestFetch, self).setUp()
+        self.destdir = tempfile.mkdtemp(prefix='alda-fetch.')
+
+    def tearDown(self):
+        super(TestFetch, self).tearDown()
+        shutil.rmtree(self.destdir)
+
+    def resolve(self, repopath):
+        alda_ = alda.ALDA({'alda-repo': repopath})
+        alda_.load_sack(arch='x86_64')
+        alda_.resolve_dependencies(BASH)
+        return alda_
+
+    def assertFetched(self, alda_):
+        for hpo in alda_.installs:
+            with open(os.path.join(self.repodir, hpo.location), 'rb') as src:
+                with open(os.path.join(self.destdir, hpo.location), 'rb') as dest:
+                    self.assertEqual(src.read(), dest.read())
+
+    def test_local(self):
+        alda_ = self.resolve(self.repodir)
+        self.assertEqual([], alda_.fetch(self.destdir))
+        self.assertFetched(alda_)
+
+        # Everything is there already.
+        self.assertEqual([], alda_.fetch(self.destdir))
+        self.assertEqual(3, alda_.stats.counters['fetch_present'])
+
+    def test_http(self):
+        alda_ = self.resolve(self.repourl)
+        item = alda_.fetch_items[0]
+        # A partial file of an interrupted download.
+        os.makedirs(os.path.dirname(os.path.join(self.destdir, item.location)))
+        with open(os.path.join(self.destdir, item.location + '.part'), 'wb') as fileobj:
+            with open(os.path.join(self.repodir, item.location), 'rb') as src:
+                fileobj.write(src.read(10))
+
+        self.assertEqual([], alda_.fetch(self.destdir, jobs=2))
+        self.assertFetched(alda_)
+        self.assertEqual(3, alda_.stats.counters['fetch_downloaded'])
+
+    def test_checksum(self):
+        item = self.resolve(self.repodir).fetch_items[0]
+        item = item._replace(checksum='0' * len(item.checksum))
+        (failed, _error), = alda.fetch([item], self.destdir)
+        self.assertEqual(item, failed)
+        self.assertFalse(os.path.exists(os.path.join(self.destdir, item.location)))
+
+
 if __name__ == '__main__':
     unittest.main()
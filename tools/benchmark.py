@@ -0,0 +1,153 @@
+# Copyright (C) 2012  Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Author(s):    Martin Gracik <mgracik@redhat.com>
+#
+
+# Times ALDA.load_sack and ALDA.resolve_dependencies for every combination of
+# the resolution options and writes the results as JSON, e.g. for repositories
+# generated with gen_repo.py. Reports of two runs can be compared with
+# --compare.
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import hawkey
+
+import alda
+
+
+OPTIONS = ('greedy', 'source', 'selfhosting', 'debuginfo', 'fulltree')
+
+
+def get_combinations(names):
+    for values in itertools.product((False, True), repeat=len(names)):
+        options = dict(alda.ALDA.DEFAULT_OPTIONS)
+        options.update(zip(names, values))
+        yield options
+
+
+def get_key(options):
+    return ','.join('%s=%d' % (name, options[name]) for name in OPTIONS)
+
+
+def sample_packages(sack, count, seed):
+    query = hawkey.Query(sack)
+    query.run()
+    names = sorted(set(hpo.name for hpo in query.result if hpo.arch != 'src' and not hpo.name.endswith('-debuginfo')))
+    names = random.Random(seed).sample(names, min(count, len(names)))
+    return set(alda.Package(name=name, arch=None) for name in names)
+
+
+def run(repodict, arch, packages, excludes, options):
+    alda_ = alda.ALDA(repodict, options)
+    start = time.time()
+    alda_.load_sack(arch=arch)
+    load_time = time.time() - start
+
+    start = time.time()
+    alda_.resolve_dependencies(packages, excludes)
+    resolve_time = time.time() - start
+    alda_.cleanup()
+
+    return dict(options=options, load_sack=load_time, resolve=resolve_time,
+                installs=len(alda_.installs), problems=len(alda_.problems))
+
+
+def compare(old, new):
+    old_results = dict((get_key(result['options']), result) for result in old['results'])
+    print('%-70s %10s %10s %8s' % ('options', 'old', 'new', 'ratio'))
+    for result in new['results']:
+        key = get_key(result['options'])
+        if key not in old_results:
+            continue
+        for phase in ('load_sack', 'resolve'):
+            before = old_results[key][phase]
+            after = result[phase]
+            ratio = after / before if before else float('inf')
+            print('%-70s %9.3fs %9.3fs %7.2fx' % ('%s %s' % (key, phase), before, after, ratio))
+        if old_results[key]['installs'] != result['installs']:
+            print('%-70s %10d %10d' % ('%s installs differ' % key, old_results[key]['installs'], result['installs']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--repository', metavar='REPOSITORY', action='append')
+    parser.add_argument('--arch', default=None)
+    parser.add_argument('--packages', metavar='FILENAME', default=None,
+                        help='package list to resolve, in the format of bin/alda')
+    parser.add_argument('--sample', type=int, default=100,
+                        help='number of random package names to resolve when no list is given')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--option', action='append', choices=OPTIONS, default=None,
+                        help='only vary this option, may be repeated')
+    parser.add_argument('-o', '--output', metavar='FILENAME', default=None, help='write the report to FILENAME')
+    parser.add_argument('--compare', metavar='FILENAME', nargs='+', default=None,
+                        help='compare two reports, or a previous report with this run')
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as old, open(args.compare[1]) as new:
+            compare(json.load(old), json.load(new))
+        raise SystemExit(0)
+    if not args.repository:
+        parser.error('at least one repository is required')
+
+    logging.basicConfig(level=logging.WARNING)
+    repodict = {}
+    for n, repo in enumerate(args.repository, start=1):
+        repodict['alda-repo-%d' % n] = repo
+
+    # The list is read like bin/alda reads it, its arches are checked against the sack.
+    loader = alda.ALDA(repodict)
+    loader.load_sack(arch=args.arch)
+    loader.cleanup()
+    if args.packages:
+        packages, excludes = alda.read_packages(args.packages, loader.arches)
+    else:
+        packages, excludes = sample_packages(loader.sack, args.sample, args.seed), set()
+
+    results = []
+    for options in get_combinations(args.option or OPTIONS):
+        result = run(repodict, args.arch, packages, excludes, options)
+        print('%-70s load %8.3fs resolve %8.3fs installs %6d' % (
+            get_key(options), result['load_sack'], result['resolve'], result['installs']))
+        results.append(result)
+
+    report = dict(date=time.strftime('%Y-%m-%d %H:%M:%S'),
+                  host=platform.node(),
+                  python=platform.python_version(),
+                  alda=alda.__version__,
+                  repositories=args.repository,
+                  arch=args.arch,
+                  packages=len(packages),
+                  excludes=len(excludes),
+                  results=results)
+    if args.output:
+        with open(args.output, 'w') as fileobj:
+            json.dump(report, fileobj, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare[0]) as fileobj:
+            compare(json.load(fileobj), report)
@@ -0,0 +1,85 @@
+# Copyright (C) 2012  Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Author(s):    Martin Gracik <mgracik@redhat.com>
+#
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import hawkey
+
+import alda
+
+
+def query_srpm(sack, hpo):
+    # The lookup Accumulator._get_srpm did before the source rpm index.
+    name, _version, _release = hpo.sourcerpm[:-8].rsplit('-', 2)
+    query = hawkey.Query(sack).filter(name=name, arch='src')
+    query.run()
+    return filter(lambda srpm: srpm.location.endswith(hpo.sourcerpm), query.result)
+
+
+def index_srpm(index, hpo):
+    srpm = index.get_srpm(hpo.sourcerpm)
+    return [srpm] if srpm else []
+
+
+def timeit(func, packages):
+    start = time.time()
+    for hpo in packages:
+        func(hpo)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--repository', metavar='REPOSITORY', action='append', required=True)
+    parser.add_argument('--arch', default=None)
+    args = parser.parse_args()
+
+    repodict = {}
+    for n, repo in enumerate(args.repository, start=1):
+        repodict['alda-repo-%d' % n] = repo
+
+    alda_ = alda.ALDA(repodict)
+    alda_.load_sack(arch=args.arch)
+
+    query = hawkey.Query(alda_.sack)
+    query.run()
+    packages = [hpo for hpo in query.result if hpo.sourcerpm]
+    if not packages:
+        raise SystemExit('No binary packages found')
+
+    start = time.time()
+    index = alda.alda.SackIndex(alda_.sack)
+    build_time = time.time() - start
+
+    mismatches = [hpo for hpo in packages if query_srpm(alda_.sack, hpo) != index_srpm(index, hpo)]
+    if mismatches:
+        raise SystemExit('Index and query lookups differ for %d packages' % len(mismatches))
+
+    query_time = timeit(lambda hpo: query_srpm(alda_.sack, hpo), packages)
+    index_time = timeit(lambda hpo: index_srpm(index, hpo), packages)
+
+    print('packages:           %d' % len(packages))
+    print('index build:        %.3f s' % build_time)
+    print('query lookup:       %.3f s (%.1f us/package)' % (query_time, query_time / len(packages) * 1e6))
+    print('index lookup:       %.3f s (%.1f us/package)' % (index_time, index_time / len(packages) * 1e6))
+    print('saving per package: %.1f us' % ((query_time - index_time) / len(packages) * 1e6))
@@ -0,0 +1,217 @@
+# Copyright (C) 2012  Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Author(s):    Martin Gracik <mgracik@redhat.com>
+#
+
+# Writes yum repository metadata for synthetic packages directly, without
+# building any rpms, so that ALDA can be measured on distro-sized repos.
+
+import argparse
+import gzip
+import hashlib
+import os
+import random
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+
+SHAPES = ('fanout', 'chain', 'cycles', 'mixed')
+
+PRIMARY_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<metadata xmlns="http://linux.duke.edu/metadata/common" '
+                  'xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="%d">\n')
+FILELISTS_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<filelists xmlns="http://linux.duke.edu/metadata/filelists" packages="%d">\n')
+
+
+class SyntheticPackage(object):
+
+    def __init__(self, name, arch, sourcerpm=None, version='1.0', release='1'):
+        self.name = name
+        self.arch = arch
+        self.version = version
+        self.release = release
+        self.sourcerpm = sourcerpm
+        self.provides = []
+        self.requires = []
+        self.files = []
+
+    @property
+    def nevra(self):
+        return '%s-%s-%s.%s' % (self.name, self.version, self.release, self.arch)
+
+    @property
+    def location(self):
+        return '%s/%s.rpm' % (self.arch, self.nevra)
+
+    @property
+    def pkgid(self):
+        return hashlib.sha256(self.nevra).hexdigest()
+
+    @staticmethod
+    def render_entries(tag, entries):
+        if not entries:
+            return ''
+        s = ['<rpm:%s>' % tag]
+        for name, evr in entries:
+            if evr:
+                version, release = evr
+                s.append('<rpm:entry name=%s flags="EQ" epoch="0" ver="%s" rel="%s"/>' % (quoteattr(name), version, release))
+            else:
+                s.append('<rpm:entry name=%s/>' % quoteattr(name))
+        s.append('</rpm:%s>' % tag)
+        return ''.join(s)
+
+    def render_primary(self):
+        # Only the files createrepo puts into primary.xml, the rest is in filelists.xml.
+        files = [f for f in self.files if f.startswith('/etc/') or 'bin/' in f]
+        return ('<package type="rpm"><name>%s</name><arch>%s</arch>'
+                '<version epoch="0" ver="%s" rel="%s"/>'
+                '<checksum type="sha256" pkgid="YES">%s</checksum>'
+                '<summary>%s</summary><description>%s</description>'
+                '<location href=%s/><format><rpm:license>GPLv2+</rpm:license>'
+                '<rpm:sourcerpm>%s</rpm:sourcerpm>%s%s%s</format></package>\n') % (
+                    self.name, self.arch, self.version, self.release, self.pkgid, self.name, self.name,
+                    quoteattr(self.location), self.sourcerpm or '',
+                    self.render_entries('provides', self.provides),
+                    self.render_entries('requires', self.requires),
+                    ''.join('<file>%s</file>' % escape(f) for f in files))
+
+    def render_filelists(self):
+        return ('<package pkgid="%s" name="%s" arch="%s"><version epoch="0" ver="%s" rel="%s"/>%s</package>\n') % (
+            self.pkgid, self.name, self.arch, self.version, self.release,
+            ''.join('<file>%s</file>' % escape(f) for f in self.files))
+
+
+class SyntheticRepo(object):
+
+    def __init__(self, count, subpackages=2, shape='fanout', fanout=3, arches=('x86_64',),
+                 file_deps=0.0, seed=0):
+        self.count = count
+        self.subpackages = subpackages
+        self.shape = shape
+        self.fanout = fanout
+        self.arches = arches
+        self.file_deps = file_deps
+        self.random = random.Random(seed)
+
+    @staticmethod
+    def get_name(n):
+        return 'synth-%06d' % n
+
+    def get_shape(self):
+        return self.random.choice(SHAPES[:-1]) if self.shape == 'mixed' else self.shape
+
+    def get_requires(self, n, shape):
+        if n == 0:
+            return []
+        if shape == 'chain':
+            return [n - 1]
+        return sorted(set(self.random.randrange(n) for _i in range(self.fanout)))
+
+    def get_buildrequires(self, n, shape):
+        if shape == 'cycles':
+            # Every SRPM needs the next one to build, the last one needs the first.
+            return [(n + 1) % self.count]
+        return self.get_requires(n, shape)
+
+    def generate(self):
+        packages = []
+        for n in range(self.count):
+            name = self.get_name(n)
+            shape = self.get_shape()
+            srpm = SyntheticPackage(name, 'src')
+            sourcerpm = '%s-%s-%s.src.rpm' % (name, srpm.version, srpm.release)
+            srpm.requires = [(self.get_name(dep), None) for dep in self.get_buildrequires(n, shape)]
+            packages.append(srpm)
+
+            requires = [(self.get_name(dep), None) for dep in self.get_requires(n, shape)]
+            if n and self.random.random() < self.file_deps:
+                # A file that is listed only in filelists.xml.
+                requires.append(('/usr/share/%s/data' % self.get_name(self.random.randrange(n)), None))
+
+            for arch in self.arches:
+                main = SyntheticPackage(name, arch, sourcerpm)
+                main.provides = [(name, (main.version, main.release))]
+                main.requires = requires
+                main.files = ['/usr/bin/%s' % name, '/usr/share/%s/data' % name]
+                packages.append(main)
+
+                for i in range(self.subpackages):
+                    sub = SyntheticPackage('%s-sub%d' % (name, i), arch, sourcerpm)
+                    sub.provides = [(sub.name, (sub.version, sub.release))]
+                    sub.requires = [(name, (main.version, main.release))]
+                    sub.files = ['/usr/share/%s/sub%d' % (name, i)]
+                    packages.append(sub)
+
+                debuginfo = SyntheticPackage('%s-debuginfo' % name, arch, sourcerpm)
+                debuginfo.files = ['/usr/lib/debug/usr/bin/%s.debug' % name]
+                packages.append(debuginfo)
+        return packages
+
+
+def write_metadata(directory, kind, header, content):
+    filename = 'repodata/%s.xml.gz' % kind
+    fileobj = gzip.open(os.path.join(directory, filename), 'wb')
+    try:
+        fileobj.write(header)
+        for chunk in content:
+            fileobj.write(chunk)
+        fileobj.write('</%s>\n' % ('metadata' if kind == 'primary' else kind))
+    finally:
+        fileobj.close()
+
+    with open(os.path.join(directory, filename), 'rb') as fileobj:
+        data = fileobj.read()
+    return ('<data type="%s"><checksum type="sha256">%s</checksum><location href="%s"/>'
+            '<timestamp>%d</timestamp><size>%d</size></data>\n') % (
+                kind, hashlib.sha256(data).hexdigest(), filename, time.time(), len(data))
+
+
+def write_repo(directory, packages):
+    repodata = os.path.join(directory, 'repodata')
+    if not os.path.isdir(repodata):
+        os.makedirs(repodata)
+
+    records = [write_metadata(directory, 'primary', PRIMARY_HEADER % len(packages),
+                              (po.render_primary() for po in packages)),
+               write_metadata(directory, 'filelists', FILELISTS_HEADER % len(packages),
+                              (po.render_filelists() for po in packages))]
+    with open(os.path.join(repodata, 'repomd.xml'), 'w') as fileobj:
+        fileobj.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<repomd xmlns="http://linux.duke.edu/metadata/repo">\n'
+                      '<revision>%d</revision>\n%s</repomd>\n' % (time.time(), ''.join(records)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory')
+    parser.add_argument('-n', '--count', type=int, default=10000, help='number of source packages')
+    parser.add_argument('-s', '--subpackages', type=int, default=2, help='subpackages per source package')
+    parser.add_argument('--shape', choices=SHAPES, default='fanout', help='shape of the dependency graph')
+    parser.add_argument('--fanout', type=int, default=3, help='requires per package for the fanout shape')
+    parser.add_argument('--arch', action='append', default=None, help='binary arches, may be repeated')
+    parser.add_argument('--file-deps', type=float, default=0.0,
+                        help='fraction of packages requiring a file only listed in filelists.xml')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    repo = SyntheticRepo(args.count, subpackages=args.subpackages, shape=args.shape, fanout=args.fanout,
+                         arches=args.arch or ['x86_64'], file_deps=args.file_deps, seed=args.seed)
+    packages = repo.generate()
+    write_repo(args.directory, packages)
+    print('Wrote: %d packages to %s' % (len(packages), args.directory))